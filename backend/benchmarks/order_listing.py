@@ -0,0 +1,103 @@
+"""CPU cost of serializing one 1000-order page of ``GET /admin/orders``.
+
+Compares, on synthetic orders shaped like the Mongo documents:
+
+* ``response_model``: build ``OrderEnhanced`` objects and let FastAPI
+  re-validate and serialize them, rendered with the stdlib JSON response
+  (the old behaviour);
+* ``response_model + orjson``: the same with the app's orjson default;
+* ``model_list_response``: validate the raw documents once and dump JSON
+  bytes directly (what the endpoint does now).
+
+No database is needed. Run from ``backend/``::
+
+    python -m benchmarks.order_listing [--orders 1000] [--repeat 50]
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import List
+
+from bson import ObjectId
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from models.admin_models import OrderEnhanced
+from services.responses import model_list_response
+
+
+def sample_orders(count: int) -> List[dict]:
+    now = datetime.utcnow()
+    return [
+        {
+            "_id": ObjectId(),
+            "id": str(uuid.uuid4()),
+            "customer_name": f"Customer {i}",
+            "customer_phone": f"+9199{i:08d}",
+            "customer_email": f"customer{i}@example.com",
+            "customer_address": f"{i} Diwali Lane, Pune 4110{i % 100:02d}",
+            "customer_type": "returning" if i % 3 else "new",
+            "items": [
+                {"product_id": str(uuid.uuid4()), "product_name": f"Sweet {j}",
+                 "price": 250.0 + j, "quantity": j + 1, "unit": "500g"}
+                for j in range(i % 4 + 1)
+            ],
+            "total_amount": 750.0 + i,
+            "delivery_cost": 50.0,
+            "delivery_date": now + timedelta(days=2),
+            "created_at": now - timedelta(minutes=i),
+            "updated_at": now - timedelta(minutes=i),
+            "status": "confirmed",
+            "delivery_status": "pending",
+            "payment_status": "paid",
+            "notes": "Leave at the gate",
+        }
+        for i in range(count)
+    ]
+
+
+async def via_response_model(field, docs, response_class) -> bytes:
+    orders = [OrderEnhanced(**doc) for doc in docs]
+    content = await serialize_response(field=field, response_content=orders, is_coroutine=True)
+    return response_class(content).body
+
+
+def cpu_ms(run, repeat: int) -> float:
+    run()  # warm up
+    start = time.process_time()
+    for _ in range(repeat):
+        run()
+    return (time.process_time() - start) * 1000 / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    docs = sample_orders(args.orders)
+    field = create_response_field(name="Response_Get_All_Orders", type_=List[OrderEnhanced])
+    loop = asyncio.new_event_loop()
+
+    results = {
+        "response_model": cpu_ms(
+            lambda: loop.run_until_complete(via_response_model(field, docs, JSONResponse)), args.repeat),
+        "response_model + orjson": cpu_ms(
+            lambda: loop.run_until_complete(via_response_model(field, docs, ORJSONResponse)), args.repeat),
+        "model_list_response": cpu_ms(
+            lambda: model_list_response(OrderEnhanced, docs).body, args.repeat),
+    }
+    loop.close()
+
+    baseline = results["response_model"]
+    print(f"CPU per request, {args.orders} orders, {args.repeat} runs each")
+    for name, ms in results.items():
+        print(f"  {name:<26}{ms:8.2f} ms  ({baseline / ms:4.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
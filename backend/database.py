@@ -0,0 +1,145 @@
+"""App-scoped MongoDB client shared by every router.
+
+The client is created once per process by the FastAPI lifespan in
+``server.py`` and handed to endpoints through the ``get_db`` dependency.
+Connection pool behaviour is configured through environment variables:
+
+    MONGO_MAX_POOL_SIZE                 max connections per server (default 100)
+    MONGO_MIN_POOL_SIZE                 connections kept open when idle (default 0)
+    MONGO_MAX_IDLE_TIME_MS              close connections idle this long
+    MONGO_WAIT_QUEUE_TIMEOUT_MS         fail a checkout after waiting this long
+    MONGO_CONNECT_TIMEOUT_MS            TCP connect timeout (default 10000)
+    MONGO_SOCKET_TIMEOUT_MS             per-operation socket timeout
+    MONGO_SERVER_SELECTION_TIMEOUT_MS   server selection timeout (default 10000)
+    MONGO_COMPRESSORS                   e.g. "zstd,snappy,zlib"
+    MONGO_READ_PREFERENCE               e.g. "primary", "secondaryPreferred"
+"""
+import os
+import threading
+from collections import defaultdict
+
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo import monitoring
+
+# Environment variable -> MongoClient option
+POOL_OPTIONS = {
+    'MONGO_MAX_POOL_SIZE': ('maxPoolSize', int),
+    'MONGO_MIN_POOL_SIZE': ('minPoolSize', int),
+    'MONGO_MAX_IDLE_TIME_MS': ('maxIdleTimeMS', int),
+    'MONGO_WAIT_QUEUE_TIMEOUT_MS': ('waitQueueTimeoutMS', int),
+    'MONGO_CONNECT_TIMEOUT_MS': ('connectTimeoutMS', int),
+    'MONGO_SOCKET_TIMEOUT_MS': ('socketTimeoutMS', int),
+    'MONGO_SERVER_SELECTION_TIMEOUT_MS': ('serverSelectionTimeoutMS', int),
+    'MONGO_COMPRESSORS': ('compressors', str),
+    'MONGO_READ_PREFERENCE': ('readPreference', str),
+}
+
+
+def client_options_from_env() -> dict:
+    """MongoClient keyword options for every pool setting present in the environment"""
+    options = {}
+    for env_var, (option, cast) in POOL_OPTIONS.items():
+        value = os.environ.get(env_var)
+        if value:
+            options[option] = cast(value)
+    return options
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Counts connection pool events per server for the pool statistics endpoint"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(lambda: defaultdict(int))
+
+    def _bump(self, event, counter):
+        address = "%s:%s" % event.address
+        with self._lock:
+            self._counters[address][counter] += 1
+
+    def pool_created(self, event):
+        self._bump(event, "pools_created")
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._bump(event, "pools_cleared")
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._bump(event, "connections_created")
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._bump(event, "connections_closed")
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._bump(event, "checkouts_failed")
+
+    def connection_checked_out(self, event):
+        self._bump(event, "checkouts")
+
+    def connection_checked_in(self, event):
+        self._bump(event, "checkins")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            servers = {address: dict(counters) for address, counters in self._counters.items()}
+        for counters in servers.values():
+            counters["open_connections"] = (
+                counters.get("connections_created", 0) - counters.get("connections_closed", 0)
+            )
+            counters["in_use"] = counters.get("checkouts", 0) - counters.get("checkins", 0)
+        return servers
+
+
+class MongoProvider:
+    """Owns the single Motor client for this process"""
+
+    def __init__(self):
+        self.client = None
+        self.db = None
+        self.options = {}
+        self.pool_listener = PoolStatsListener()
+
+    def connect(self) -> AsyncIOMotorDatabase:
+        if self.client is None:
+            self.options = client_options_from_env()
+            self.client = AsyncIOMotorClient(
+                os.environ['MONGO_URL'],
+                event_listeners=[self.pool_listener],
+                **self.options
+            )
+            self.db = self.client[os.environ['DB_NAME']]
+        return self.db
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+            self.db = None
+
+    def pool_stats(self) -> dict:
+        return {
+            "options": self.options,
+            "max_pool_size": self.client.delegate.options.pool_options.max_pool_size if self.client else None,
+            "servers": self.pool_listener.snapshot(),
+        }
+
+
+mongo = MongoProvider()
+
+
+def get_db() -> AsyncIOMotorDatabase:
+    """FastAPI dependency returning the shared database handle"""
+    if mongo.db is None:
+        raise RuntimeError("MongoDB client is not connected")
+    return mongo.db
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import List, Optional, Literal
 from datetime import datetime
 from enum import Enum
 
@@ -118,8 +118,19 @@ class MessageTemplate(BaseModel):
     name: str
     message: str
     variables: List[str] = []  # Available variables like {name}, {link}, etc.
+    version: int = 1  # Bumped on every edit; compiled templates are cached per version
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+class CampaignCreate(BaseModel):
+    template_id: str
+    # Recipients: explicit contact ids, or every contact matching the filters;
+    # messaging every contact needs all_contacts=True
+    contact_ids: Optional[List[str]] = None
+    relationship: Optional[str] = None
+    not_contacted_since: Optional[datetime] = None
+    all_contacts: bool = False
+    expires_in_days: Optional[int] = 30
+
 # Order Management Models
 class OrderItem(BaseModel):
     product_id: str
@@ -267,6 +278,13 @@ class VisitorSession(BaseModel):
     is_active: bool = True
     converted_to_customer: bool = False
 
+class SessionHeartbeat(BaseModel):
+    session_id: str
+    visitor_type: Optional[str] = "anonymous"
+    referral_link_token: Optional[str] = None
+    ip_address: Optional[str] = None
+    user_agent: Optional[str] = None
+
 class VisitorEvent(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     session_id: str
@@ -283,6 +301,20 @@ class VisitorEvent(BaseModel):
     timestamp: datetime = Field(default_factory=datetime.utcnow)
     properties: Optional[dict] = {}
 
+# Batched tracking items (POST /api/track/batch)
+class BatchVisitorEvent(VisitorEvent):
+    kind: Literal["visitor"]
+
+class BatchLinkEvent(BaseModel):
+    kind: Literal["link"]
+    link_token: str
+    event_type: str
+    page_url: Optional[str] = None
+    product_id: Optional[str] = None
+    timestamp: datetime = Field(default_factory=datetime.utcnow)
+    user_agent: Optional[str] = None
+    ip_address: Optional[str] = None
+
 # Cart Abandonment Tracking
 class CartAbandonmentSession(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
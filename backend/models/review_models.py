@@ -57,6 +57,9 @@ class ReviewStats(BaseModel):
     completed_reviews: int
     review_response_rate: float
     average_overall_rating: float
+    average_taste_rating: Optional[float] = None
+    average_packaging_rating: Optional[float] = None
+    average_delivery_rating: Optional[float] = None
     recent_reviews: List[CustomerReview]
 
 class ReviewRequestSummary(BaseModel):
@@ -1,6 +1,8 @@
-from fastapi import APIRouter, HTTPException, Depends, Query, UploadFile, File
-from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Depends, Query, UploadFile, File, Response
+from fastapi.responses import StreamingResponse
+from typing import List, Literal, Optional
 from datetime import datetime, timedelta
+import asyncio
 import uuid
 from models.admin_models import (
     Product, ProductCreate, ProductUpdate, ProductStatus,
@@ -8,16 +10,33 @@ from models.admin_models import (
     LinkAnalytics, MessageTemplate, OrderEnhanced, OrderUpdate,
     VisitorSession, VisitorEvent, CartAbandonmentSession,
     DashboardAnalytics, CustomerAnalytics, DeliveryStatus,
-    PaymentStatus, CustomerType, VisitorType
+    PaymentStatus, CustomerType, VisitorType, SessionHeartbeat, CampaignCreate
 )
 import os
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from database import get_db, mongo
+from services.aggregations import ORDER_FINAL_AMOUNT
+from services.campaigns import build_link, personalized_url, run_campaign
+from services.catalog_cache import catalog_cache
+from services.contact_import import import_contacts_file, normalize_phone, upsert_contacts
+from services.event_buffer import VisitorEventBuffer, get_visitor_event_buffer
+from services.link_stats import record_link_event
+from services.link_tokens import link_token_cache
+from services.indexes import get_index_stats
+from services.images import UploadLimitRoute, save_image
+from services.order_export import EXPORT_BATCH_SIZE, EXPORT_WRITERS, MEDIA_TYPES
+from services.pagination import NEWEST_FIRST, cursor_filter, encode_cursor
+from services.projections import partial_model, projection, select_fields
+from services.responses import model_list_response
+from services.revenue_cube import order_day, refresh_daily_revenue
+from services.templates import CompiledTemplate, TemplateError, compile_message, compiled_template
+from services.visitor_sessions import record_heartbeat, record_heartbeats
+from routes.tracking_routes import MAX_TRACKING_BATCH
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
-# Get database instance (assuming it's already configured in main server.py)
-from server import db
-
 # Authentication middleware (simple admin check)
 async def verify_admin(admin_key: str = Query(...)):
     # Simple admin authentication - in production use proper JWT
@@ -29,7 +48,7 @@ async def verify_admin(admin_key: str = Query(...)):
 # PRODUCT MANAGEMENT ENDPOINTS
 
 @router.post("/products", response_model=Product)
-async def create_product(product: ProductCreate, admin_key: str = Depends(verify_admin)):
+async def create_product(product: ProductCreate, admin_key: str = Depends(verify_admin), db: AsyncIOMotorDatabase = Depends(get_db)):
     """Create a new product"""
     product_dict = product.dict()
     product_dict["id"] = str(uuid.uuid4())
@@ -38,25 +57,26 @@ async def create_product(product: ProductCreate, admin_key: str = Depends(verify
     
     result = await db.products.insert_one(product_dict)
     if result.inserted_id:
+        await catalog_cache.invalidate(db)
         return Product(**product_dict)
     raise HTTPException(status_code=400, detail="Failed to create product")
 
 @router.get("/products", response_model=List[Product])
-async def get_all_products(admin_key: str = Depends(verify_admin)):
+async def get_all_products(admin_key: str = Depends(verify_admin), db: AsyncIOMotorDatabase = Depends(get_db)):
     """Get all products for admin"""
-    products = await db.products.find().to_list(1000)
-    return [Product(**product) for product in products]
+    # Served from the catalog cache, already validated and serialized
+    return Response(content=await catalog_cache.get_serialized(db), media_type="application/json")
 
 @router.get("/products/{product_id}", response_model=Product)
-async def get_product(product_id: str, admin_key: str = Depends(verify_admin)):
+async def get_product(product_id: str, admin_key: str = Depends(verify_admin), db: AsyncIOMotorDatabase = Depends(get_db)):
     """Get single product"""
-    product = await db.products.find_one({"id": product_id})
+    product = await catalog_cache.get(db, product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    return Product(**product)
+    return product
 
 @router.put("/products/{product_id}", response_model=Product)
-async def update_product(product_id: str, updates: ProductUpdate, admin_key: str = Depends(verify_admin)):
+async def update_product(product_id: str, updates: ProductUpdate, admin_key: str = Depends(verify_admin), db: AsyncIOMotorDatabase = Depends(get_db)):
     """Update product"""
     update_dict = {k: v for k, v in updates.dict().items() if v is not None}
     update_dict["updated_at"] = datetime.utcnow()
@@ -69,73 +89,85 @@ async def update_product(product_id: str, updates: ProductUpdate, admin_key: str
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
     
+    await catalog_cache.invalidate(db)
     product = await db.products.find_one({"id": product_id})
     return Product(**product)
 
 @router.delete("/products/{product_id}")
-async def delete_product(product_id: str, admin_key: str = Depends(verify_admin)):
+async def delete_product(product_id: str, admin_key: str = Depends(verify_admin), db: AsyncIOMotorDatabase = Depends(get_db)):
     """Delete product"""
     result = await db.products.delete_one({"id": product_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
+    await catalog_cache.invalidate(db)
     return {"message": "Product deleted successfully"}
 
-@router.post("/upload-image")
 async def upload_image(file: UploadFile = File(...), admin_key: str = Depends(verify_admin)):
     """Upload product image"""
     if not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="File must be an image")
     
-    # Create uploads directory if it doesn't exist
-    upload_dir = "/app/uploads"
-    os.makedirs(upload_dir, exist_ok=True)
-    
-    # Generate unique filename
-    file_extension = os.path.splitext(file.filename)[1]
-    filename = f"{uuid.uuid4()}{file_extension}"
-    file_path = os.path.join(upload_dir, filename)
-    
-    # Save file
-    with open(file_path, "wb") as buffer:
-        content = await file.read()
-        buffer.write(content)
-    
-    # Return URL (adjust based on your static file serving)
-    image_url = f"/uploads/{filename}"
-    return {"image_url": image_url}
+    # Streamed to disk, de-duplicated by content and resized to WebP variants
+    return await save_image(file)
+
+# Oversized bodies are refused from Content-Length before multipart parsing
+router.add_api_route("/upload-image", upload_image, methods=["POST"], route_class_override=UploadLimitRoute)
 
 # CONTACT MANAGEMENT ENDPOINTS
 
 @router.post("/contacts", response_model=Contact)
-async def create_contact(contact: ContactCreate, admin_key: str = Depends(verify_admin)):
+async def create_contact(contact: ContactCreate, admin_key: str = Depends(verify_admin), db: AsyncIOMotorDatabase = Depends(get_db)):
     """Add new contact"""
     contact_dict = contact.dict()
     contact_dict["id"] = str(uuid.uuid4())
     contact_dict["created_at"] = datetime.utcnow()
-    
-    result = await db.contacts.insert_one(contact_dict)
+    phone_normalized = normalize_phone(contact.phone)
+    if phone_normalized:
+        contact_dict["phone_normalized"] = phone_normalized
+    
+    try:
+        result = await db.contacts.insert_one(contact_dict)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="A contact with this phone number already exists")
     if result.inserted_id:
         return Contact(**contact_dict)
     raise HTTPException(status_code=400, detail="Failed to create contact")
 
-@router.get("/contacts", response_model=List[Contact])
-async def get_contacts(admin_key: str = Depends(verify_admin)):
+# Contact list columns returned without fields=; the Contacts tab renders all
+# of them, notes included
+CONTACT_LIST_FIELDS = ("id", "name", "phone", "email", "relationship", "notes", "last_contacted")
+
+@router.get("/contacts", response_model=List[partial_model(Contact)])
+async def get_contacts(
+    fields: Optional[str] = Query(None, description="Comma-separated Contact fields, or * for all"),
+    admin_key: str = Depends(verify_admin),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
     """Get all contacts"""
-    contacts = await db.contacts.find().to_list(1000)
-    return [Contact(**contact) for contact in contacts]
+    selected = select_fields(Contact, fields, CONTACT_LIST_FIELDS)
+    contacts = await db.contacts.find({}, projection(selected)).to_list(1000)
+    return model_list_response(Contact, contacts, fields=selected)
 
 @router.post("/contacts/bulk-import")
-async def bulk_import_contacts(contacts: List[ContactCreate], admin_key: str = Depends(verify_admin)):
+async def bulk_import_contacts(contacts: List[ContactCreate], admin_key: str = Depends(verify_admin), db: AsyncIOMotorDatabase = Depends(get_db)):
     """Bulk import contacts"""
-    contact_dicts = []
-    for contact in contacts:
-        contact_dict = contact.dict()
-        contact_dict["id"] = str(uuid.uuid4())
-        contact_dict["created_at"] = datetime.utcnow()
-        contact_dicts.append(contact_dict)
+    report = await upsert_contacts(db, (contact.dict() for contact in contacts))
+    return {"message": f"Imported {report['inserted'] + report['updated']} contacts successfully", **report}
+
+@router.post("/contacts/import")
+async def import_contacts(
+    file: UploadFile = File(...),
+    relationship: str = "other",
+    admin_key: str = Depends(verify_admin),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """Import contacts from a CSV file or vCard, merging on phone number.
     
-    result = await db.contacts.insert_many(contact_dicts)
-    return {"message": f"Imported {len(result.inserted_ids)} contacts successfully"}
+    CSV files need a header row with name and phone columns (email,
+    relationship and notes are optional); relationship fills in for rows
+    and cards that have none.
+    """
+    return await import_contacts_file(db, file, default_relationship=relationship)
 
 # PERSONALIZED LINK ENDPOINTS
 
@@ -144,7 +176,8 @@ async def create_personalized_link(
     contact_id: str,
     message: str,
     expires_in_days: Optional[int] = 30,
-    admin_key: str = Depends(verify_admin)
+    admin_key: str = Depends(verify_admin),
+    db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """Create personalized link for a contact"""
     # Check if contact exists
@@ -153,26 +186,13 @@ async def create_personalized_link(
         raise HTTPException(status_code=404, detail="Contact not found")
     
     # Create personalized link
-    link_data = {
-        "id": str(uuid.uuid4()),
-        "contact_id": contact_id,
-        "link_token": str(uuid.uuid4().hex),
-        "message": message,
-        "created_at": datetime.utcnow(),
-        "expires_at": datetime.utcnow() + timedelta(days=expires_in_days) if expires_in_days else None,
-        "is_active": True
-    }
+    link_data = build_link(contact_id, message, datetime.utcnow(), expires_in_days)
     
     result = await db.personalized_links.insert_one(link_data)
     if result.inserted_id:
-        # Generate the personalized URL
-        domain = os.environ.get('APP_DOMAIN', 'localhost:3000')
-        protocol = 'https' if 'localhost' not in domain else 'http'
-        personalized_url = f"{protocol}://{domain}/?ref={link_data['link_token']}"
-        
         return {
             "link_id": link_data["id"],
-            "personalized_url": personalized_url,
+            "personalized_url": personalized_url(link_data["link_token"]),
             "message": message,
             "contact_name": contact["name"],
             "expires_at": link_data["expires_at"]
@@ -180,11 +200,30 @@ async def create_personalized_link(
     
     raise HTTPException(status_code=400, detail="Failed to create personalized link")
 
+@router.put("/personalized-links/{link_id}/deactivate")
+async def deactivate_personalized_link(
+    link_id: str,
+    admin_key: str = Depends(verify_admin),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """Deactivate a personalized link so it stops tracking"""
+    link = await db.personalized_links.find_one_and_update(
+        {"id": link_id},
+        {"$set": {"is_active": False}},
+        projection={"link_token": 1}
+    )
+    if not link:
+        raise HTTPException(status_code=404, detail="Personalized link not found")
+    
+    link_token_cache.invalidate(link["link_token"])
+    return {"message": "Personalized link deactivated"}
+
 @router.post("/send-personalized-message")
 async def send_personalized_message(
     contact_id: str,
     message_template: str,
-    admin_key: str = Depends(verify_admin)
+    admin_key: str = Depends(verify_admin),
+    db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """Send personalized message with link to contact"""
     # Get contact
@@ -193,11 +232,13 @@ async def send_personalized_message(
         raise HTTPException(status_code=404, detail="Contact not found")
     
     # Create personalized link
-    link_response = await create_personalized_link(contact_id, message_template)
+    link_response = await create_personalized_link(contact_id, message_template, db=db)
     
     # Format message with personalized link
-    personalized_message = message_template.replace("{name}", contact["name"])
-    personalized_message = personalized_message.replace("{link}", link_response["personalized_url"])
+    personalized_message = compile_message(message_template).render({
+        "name": contact["name"],
+        "link": link_response["personalized_url"]
+    })
     
     # Here you would integrate with SMS/WhatsApp API
     # For now, we'll return the formatted message
@@ -216,6 +257,59 @@ async def send_personalized_message(
         "status": "ready_to_send"
     }
 
+@router.post("/campaigns")
+async def create_campaign(
+    campaign: CampaignCreate,
+    admin_key: str = Depends(verify_admin),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """Prepare a personalized message for many contacts at once.
+    
+    Recipients are the given contact_ids, or every contact matching the
+    filters; targeting every contact needs all_contacts=true. Results stream
+    back as NDJSON, one ready-to-send message per line; the campaign id is in
+    the X-Campaign-Id header.
+    """
+    has_selector = campaign.contact_ids is not None or campaign.relationship or campaign.not_contacted_since
+    if not has_selector and not campaign.all_contacts:
+        raise HTTPException(
+            status_code=400,
+            detail="Select recipients with contact_ids, relationship or not_contacted_since, or set all_contacts"
+        )
+    
+    template = await db.message_templates.find_one({"id": campaign.template_id})
+    if not template:
+        raise HTTPException(status_code=404, detail="Message template not found")
+    try:
+        compiled = compiled_template(template)
+    except TemplateError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    contact_query = {}
+    if campaign.contact_ids is not None:
+        contact_query["id"] = {"$in": campaign.contact_ids}
+    if campaign.relationship:
+        contact_query["relationship"] = campaign.relationship
+    if campaign.not_contacted_since:
+        contact_query["$or"] = [
+            {"last_contacted": None},
+            {"last_contacted": {"$lt": campaign.not_contacted_since}}
+        ]
+    
+    campaign_data = {
+        "id": str(uuid.uuid4()),
+        "template_id": campaign.template_id,
+        "filter": campaign.dict(exclude={"template_id", "expires_in_days"}),
+        "created_at": datetime.utcnow()
+    }
+    await db.campaigns.insert_one(campaign_data)
+    
+    return StreamingResponse(
+        run_campaign(db, campaign_data, template, compiled, contact_query, campaign.expires_in_days),
+        media_type="application/x-ndjson",
+        headers={"X-Campaign-Id": campaign_data["id"]}
+    )
+
 # TRACKING ENDPOINTS
 
 @router.post("/track-event")
@@ -225,19 +319,20 @@ async def track_event(
     page_url: Optional[str] = None,
     product_id: Optional[str] = None,
     user_agent: Optional[str] = None,
-    ip_address: Optional[str] = None
+    ip_address: Optional[str] = None,
+    db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """Track user events (no admin auth required for tracking)"""
-    # Find the personalized link
-    link = await db.personalized_links.find_one({"link_token": link_token, "is_active": True})
+    # Resolve the personalized link (cached, including unknown tokens)
+    link = await link_token_cache.resolve(db, link_token)
     if not link:
         raise HTTPException(status_code=404, detail="Invalid or expired link")
     
     # Create tracking event
     tracking_data = {
         "id": str(uuid.uuid4()),
-        "link_id": link["id"],
-        "contact_id": link["contact_id"],
+        "link_id": link.link_id,
+        "contact_id": link.contact_id,
         "event_type": event_type,
         "page_url": page_url,
         "product_id": product_id,
@@ -246,13 +341,17 @@ async def track_event(
         "ip_address": ip_address
     }
     
-    await db.link_tracking.insert_one(tracking_data)
+    await asyncio.gather(
+        db.link_tracking.insert_one(tracking_data),
+        record_link_event(db, tracking_data)
+    )
     return {"status": "tracked"}
 
 @router.get("/analytics/links", response_model=List[LinkAnalytics])
-async def get_link_analytics(admin_key: str = Depends(verify_admin)):
+async def get_link_analytics(admin_key: str = Depends(verify_admin), db: AsyncIOMotorDatabase = Depends(get_db)):
     """Get analytics for all personalized links"""
-    # Aggregate analytics data
+    # Each link joins its contact and its pre-aggregated link_stats rollup,
+    # both single-document lookups on indexed fields
     pipeline = [
         {
             "$lookup": {
@@ -267,10 +366,10 @@ async def get_link_analytics(admin_key: str = Depends(verify_admin)):
         },
         {
             "$lookup": {
-                "from": "link_tracking",
+                "from": "link_stats",
                 "localField": "id",
                 "foreignField": "link_id",
-                "as": "tracking_events"
+                "as": "stats"
             }
         }
     ]
@@ -279,37 +378,31 @@ async def get_link_analytics(admin_key: str = Depends(verify_admin)):
     
     analytics_results = []
     for link_data in links_with_analytics:
-        events = link_data.get("tracking_events", [])
-        
-        # Calculate analytics
-        opens = [e for e in events if e["event_type"] == "link_opened"]
-        page_views = [e for e in events if e["event_type"] == "page_viewed"]
-        cart_adds = [e for e in events if e["event_type"] == "item_added"]
-        checkouts = [e for e in events if e["event_type"] == "checkout_started"]
-        orders = [e for e in events if e["event_type"] == "order_placed"]
+        stats = link_data["stats"][0] if link_data["stats"] else {}
+        total_opens = stats.get("total_opens", 0)
         
         analytics = LinkAnalytics(
             link_id=link_data["id"],
             contact_name=link_data["contact"]["name"],
             contact_phone=link_data["contact"]["phone"],
-            total_opens=len(opens),
-            unique_opens=1 if opens else 0,  # Simplified - could be more sophisticated
-            last_opened=max([e["timestamp"] for e in opens]) if opens else None,
-            pages_viewed=list(set([e["page_url"] for e in page_views if e["page_url"]])),
-            products_viewed=list(set([e["product_id"] for e in events if e["product_id"]])),
-            items_added_to_cart=len(cart_adds),
-            checkout_started=len(checkouts) > 0,
-            order_placed=len(orders) > 0,
+            total_opens=total_opens,
+            unique_opens=1 if total_opens else 0,  # Simplified - could be more sophisticated
+            last_opened=stats.get("last_opened"),
+            pages_viewed=stats.get("pages_viewed", []),
+            products_viewed=stats.get("products_viewed", []),
+            items_added_to_cart=stats.get("items_added_to_cart", 0),
+            checkout_started=stats.get("checkouts_started", 0) > 0,
+            order_placed=stats.get("orders_placed", 0) > 0,
             total_order_value=None,  # Would need order data integration
             created_at=link_data["created_at"],
             link_status="active" if link_data["is_active"] else "inactive"
         )
         analytics_results.append(analytics)
     
-    return analytics_results
+    return model_list_response(LinkAnalytics, analytics_results)
 
 @router.get("/analytics/summary")
-async def get_analytics_summary(admin_key: str = Depends(verify_admin)):
+async def get_analytics_summary(admin_key: str = Depends(verify_admin), db: AsyncIOMotorDatabase = Depends(get_db)):
     """Get overall analytics summary"""
     total_links = await db.personalized_links.count_documents({})
     total_contacts = await db.contacts.count_documents({})
@@ -333,13 +426,36 @@ async def get_analytics_summary(admin_key: str = Depends(verify_admin)):
         "last_updated": datetime.utcnow()
     }
 
+@router.get("/analytics/index-usage")
+async def get_index_usage(admin_key: str = Depends(verify_admin), db: AsyncIOMotorDatabase = Depends(get_db)):
+    """Report per-index usage counters for every indexed collection"""
+    return {
+        "collections": await get_index_stats(db),
+        "last_updated": datetime.utcnow()
+    }
+
+@router.get("/analytics/db-pool")
+async def get_db_pool_stats(admin_key: str = Depends(verify_admin)):
+    """Report MongoDB connection pool settings and usage for this worker"""
+    return {
+        "pid": os.getpid(),
+        **mongo.pool_stats(),
+        "last_updated": datetime.utcnow()
+    }
+
 # MESSAGE TEMPLATES
 
 @router.post("/message-templates", response_model=MessageTemplate)
-async def create_message_template(template: MessageTemplate, admin_key: str = Depends(verify_admin)):
+async def create_message_template(template: MessageTemplate, admin_key: str = Depends(verify_admin), db: AsyncIOMotorDatabase = Depends(get_db)):
     """Create message template"""
+    try:
+        CompiledTemplate(template.message, template.variables)
+    except TemplateError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
     template_dict = template.dict()
     template_dict["id"] = str(uuid.uuid4())
+    template_dict["version"] = 1
     template_dict["created_at"] = datetime.utcnow()
     
     result = await db.message_templates.insert_one(template_dict)
@@ -347,24 +463,41 @@ async def create_message_template(template: MessageTemplate, admin_key: str = De
         return MessageTemplate(**template_dict)
     raise HTTPException(status_code=400, detail="Failed to create template")
 
+@router.put("/message-templates/{template_id}", response_model=MessageTemplate)
+async def update_message_template(template_id: str, template: MessageTemplate, admin_key: str = Depends(verify_admin), db: AsyncIOMotorDatabase = Depends(get_db)):
+    """Edit a message template; its version is bumped so compiled copies are rebuilt"""
+    try:
+        CompiledTemplate(template.message, template.variables)
+    except TemplateError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    updated = await db.message_templates.find_one_and_update(
+        {"id": template_id},
+        {
+            "$set": {"name": template.name, "message": template.message, "variables": template.variables},
+            "$inc": {"version": 1}
+        },
+        return_document=ReturnDocument.AFTER
+    )
+    if not updated:
+        raise HTTPException(status_code=404, detail="Message template not found")
+    return MessageTemplate(**updated)
+
 @router.get("/message-templates", response_model=List[MessageTemplate])
-async def get_message_templates(admin_key: str = Depends(verify_admin)):
+async def get_message_templates(admin_key: str = Depends(verify_admin), db: AsyncIOMotorDatabase = Depends(get_db)):
     """Get all message templates"""
     templates = await db.message_templates.find().to_list(100)
     return [MessageTemplate(**template) for template in templates]
 
 # ENHANCED ORDER MANAGEMENT ENDPOINTS
 
-@router.get("/orders", response_model=List[OrderEnhanced])
-async def get_all_orders(
+def build_order_query(
     status: Optional[str] = None,
     delivery_status: Optional[str] = None,
     date_from: Optional[str] = None,
-    date_to: Optional[str] = None,
-    limit: Optional[int] = 100,
-    admin_key: str = Depends(verify_admin)
-):
-    """Get all orders with advanced filtering"""
+    date_to: Optional[str] = None
+) -> dict:
+    """Mongo filter for the order listing filters"""
     query = {}
     
     if status:
@@ -376,12 +509,83 @@ async def get_all_orders(
             "$gte": datetime.fromisoformat(date_from),
             "$lte": datetime.fromisoformat(date_to)
         }
+    return query
+
+# Order columns returned without fields=; the admin order tables render the
+# items, address and notes, so only tracking and audit fields are left out
+ORDER_LIST_FIELDS = (
+    "id", "customer_name", "customer_phone", "customer_address", "is_repeat_customer",
+    "previous_orders_count", "items", "total_amount", "delivery_cost", "delivery_date",
+    "dispatched_date", "created_at", "status", "delivery_status", "payment_status", "notes",
+)
+CUSTOMER_ORDER_FIELDS = (
+    "id", "created_at", "status", "delivery_status", "payment_status",
+    "total_amount", "delivery_cost", "delivery_date",
+)
+
+@router.get("/orders", response_model=List[partial_model(OrderEnhanced)])
+async def get_all_orders(
+    status: Optional[str] = None,
+    delivery_status: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    include_total: bool = False,
+    fields: Optional[str] = Query(None, description="Comma-separated OrderEnhanced fields, or * for all"),
+    admin_key: str = Depends(verify_admin),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """Get orders newest first, one keyset page at a time.
+    
+    The cursor for the next page is returned in the X-Next-Cursor header
+    (absent on the last page); include_total=true adds X-Total-Count.
+    """
+    # created_at and id are always returned since the cursor is built from them
+    selected = select_fields(OrderEnhanced, fields, ORDER_LIST_FIELDS, required=("id", "created_at"))
+    query = build_order_query(status, delivery_status, date_from, date_to)
+    page_query = {"$and": [query, cursor_filter(cursor)]} if cursor else query
+    
+    headers = {}
+    
+    # Fetch one extra order to learn whether another page follows
+    page = db.orders.find(page_query, projection(selected)).sort(NEWEST_FIRST).limit(limit + 1).to_list(limit + 1)
+    if include_total:
+        orders, total = await asyncio.gather(page, db.orders.count_documents(query))
+        headers["X-Total-Count"] = str(total)
+    else:
+        orders = await page
+    
+    if len(orders) > limit:
+        orders = orders[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(orders[-1])
     
-    orders = await db.orders.find(query).limit(limit).sort("created_at", -1).to_list(limit)
-    return [OrderEnhanced(**order) for order in orders]
+    # Validated once and serialized straight to JSON
+    return model_list_response(OrderEnhanced, orders, headers=headers, fields=selected)
+
+@router.get("/orders/export")
+async def export_orders(
+    status: Optional[str] = None,
+    delivery_status: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    export_format: Literal["csv", "ndjson"] = Query("csv", alias="format"),
+    admin_key: str = Depends(verify_admin),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """Stream every order matching the listing filters as CSV or NDJSON"""
+    query = build_order_query(status, delivery_status, date_from, date_to)
+    cursor = db.orders.find(query, {"_id": 0}).sort(NEWEST_FIRST).batch_size(EXPORT_BATCH_SIZE)
+    
+    filename = f"orders-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.{export_format}"
+    return StreamingResponse(
+        EXPORT_WRITERS[export_format](cursor),
+        media_type=MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 @router.get("/orders/{order_id}", response_model=OrderEnhanced)
-async def get_order(order_id: str, admin_key: str = Depends(verify_admin)):
+async def get_order(order_id: str, admin_key: str = Depends(verify_admin), db: AsyncIOMotorDatabase = Depends(get_db)):
     """Get single order details"""
     order = await db.orders.find_one({"id": order_id})
     if not order:
@@ -392,7 +596,8 @@ async def get_order(order_id: str, admin_key: str = Depends(verify_admin)):
 async def update_order(
     order_id: str, 
     updates: OrderUpdate, 
-    admin_key: str = Depends(verify_admin)
+    admin_key: str = Depends(verify_admin),
+    db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """Update order status, delivery details, etc."""
     update_dict = {k: v for k, v in updates.dict().items() if v is not None}
@@ -411,21 +616,29 @@ async def update_order(
         raise HTTPException(status_code=404, detail="Order not found")
     
     order = await db.orders.find_one({"id": order_id})
+    await refresh_daily_revenue(db, [order_day(order["created_at"])])
     return OrderEnhanced(**order)
 
-@router.get("/orders/customer/{phone}")
-async def get_customer_orders(phone: str, admin_key: str = Depends(verify_admin)):
+@router.get("/orders/customer/{phone}", response_model=List[partial_model(OrderEnhanced)])
+async def get_customer_orders(
+    phone: str,
+    fields: Optional[str] = Query(None, description="Comma-separated OrderEnhanced fields, or * for all"),
+    admin_key: str = Depends(verify_admin),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
     """Get all orders for a specific customer by phone number"""
-    orders = await db.orders.find({"customer_phone": phone}).sort("created_at", -1).to_list(100)
-    return [OrderEnhanced(**order) for order in orders]
+    selected = select_fields(OrderEnhanced, fields, CUSTOMER_ORDER_FIELDS)
+    orders = await db.orders.find({"customer_phone": phone}, projection(selected)).sort("created_at", -1).to_list(100)
+    return model_list_response(OrderEnhanced, orders, fields=selected)
 
 # VISITOR ANALYTICS ENDPOINTS
 
-@router.get("/analytics/visitors")
+@router.get("/analytics/visitors", response_model=DashboardAnalytics)
 async def get_visitor_analytics(
     date_from: Optional[str] = None,
     date_to: Optional[str] = None,
-    admin_key: str = Depends(verify_admin)
+    admin_key: str = Depends(verify_admin),
+    db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """Get comprehensive visitor analytics"""
     # Set default date range (last 30 days)
@@ -436,39 +649,75 @@ async def get_visitor_analytics(
         date_from_dt = datetime.fromisoformat(date_from)
         date_to_dt = datetime.fromisoformat(date_to)
     
-    # Get visitor sessions in date range
-    sessions = await db.visitor_sessions.find({
-        "first_visit": {"$gte": date_from_dt, "$lte": date_to_dt}
-    }).to_list(1000)
+    date_match = {"$gte": date_from_dt, "$lte": date_to_dt}
+    
+    # Session metrics, computed inside MongoDB so they are exact at any volume
+    session_pipeline = [
+        {"$match": {"first_visit": date_match}},
+        {
+            "$facet": {
+                "totals": [
+                    {
+                        "$group": {
+                            "_id": None,
+                            "total_sessions": {"$sum": 1},
+                            "returning_visitors": {
+                                "$sum": {"$cond": [{"$eq": ["$visitor_type", "customer"]}, 1, 0]}
+                            },
+                            "total_time": {"$sum": {"$ifNull": ["$total_time_spent", 0]}},
+                            "total_page_views": {"$sum": {"$ifNull": ["$total_page_views", 0]}}
+                        }
+                    }
+                ],
+                "unique_visitors": [
+                    {"$group": {"_id": "$session_id"}},
+                    {"$count": "count"}
+                ]
+            }
+        }
+    ]
+    
+    # Order metrics; final_amount is derived when it was never stored on the order
+    order_pipeline = [
+        {"$match": {"created_at": date_match}},
+        {
+            "$group": {
+                "_id": None,
+                "total_orders": {"$sum": 1},
+                "total_revenue": {"$sum": ORDER_FINAL_AMOUNT}
+            }
+        }
+    ]
+    
+    session_result, order_result, abandoned_carts = await asyncio.gather(
+        db.visitor_sessions.aggregate(session_pipeline).to_list(1),
+        db.orders.aggregate(order_pipeline).to_list(1),
+        db.cart_abandonments.count_documents({"abandoned_at": date_match})
+    )
+    
+    session_totals = session_result[0]["totals"][0] if session_result and session_result[0]["totals"] else {}
+    unique_result = session_result[0]["unique_visitors"] if session_result else []
+    order_totals = order_result[0] if order_result else {}
     
     # Calculate metrics
-    total_sessions = len(sessions)
-    unique_visitors = len(set(s.get("session_id") for s in sessions))
-    returning_visitors = len([s for s in sessions if s.get("visitor_type") == "customer"])
+    total_sessions = session_totals.get("total_sessions", 0)
+    unique_visitors = unique_result[0]["count"] if unique_result else 0
+    returning_visitors = session_totals.get("returning_visitors", 0)
     new_visitors = total_sessions - returning_visitors
     
     # Engagement metrics
-    total_time = sum(s.get("total_time_spent", 0) for s in sessions)
+    total_time = session_totals.get("total_time", 0)
     avg_session_duration = total_time / total_sessions if total_sessions > 0 else 0
     
-    total_page_views = sum(s.get("total_page_views", 0) for s in sessions)
+    total_page_views = session_totals.get("total_page_views", 0)
     pages_per_session = total_page_views / total_sessions if total_sessions > 0 else 0
     
     # E-commerce metrics
-    orders = await db.orders.find({
-        "created_at": {"$gte": date_from_dt, "$lte": date_to_dt}
-    }).to_list(1000)
-    
-    total_orders = len(orders)
-    total_revenue = sum(order.get("final_amount", 0) for order in orders)
+    total_orders = order_totals.get("total_orders", 0)
+    total_revenue = order_totals.get("total_revenue", 0)
     avg_order_value = total_revenue / total_orders if total_orders > 0 else 0
     conversion_rate = (total_orders / total_sessions * 100) if total_sessions > 0 else 0
     
-    # Cart abandonment
-    abandoned_carts = await db.cart_abandonments.count_documents({
-        "abandoned_at": {"$gte": date_from_dt, "$lte": date_to_dt}
-    })
-    
     return DashboardAnalytics(
         date_range=f"{date_from_dt.strftime('%Y-%m-%d')} to {date_to_dt.strftime('%Y-%m-%d')}",
         total_visitors=total_sessions,
@@ -484,29 +733,72 @@ async def get_visitor_analytics(
         abandoned_carts=abandoned_carts
     )
 
-@router.get("/analytics/customers")
-async def get_customer_analytics(admin_key: str = Depends(verify_admin)):
-    """Get detailed customer analytics"""
-    # Aggregate customer data
+@router.get("/analytics/customers", response_model=List[CustomerAnalytics])
+async def get_customer_analytics(
+    limit: int = Query(50, ge=1, le=500),
+    skip: int = Query(0, ge=0),
+    favorites_limit: int = Query(5, ge=1, le=20),
+    admin_key: str = Depends(verify_admin),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """Get detailed customer analytics, top spenders first"""
+    # Aggregate customer data. Only scalar accumulators are grouped so each
+    # customer group stays a few bytes regardless of order history, and the
+    # sort/skip/limit run server-side before the per-customer favourites lookup.
     pipeline = [
         {
             "$group": {
                 "_id": "$customer_phone",
                 "customer_name": {"$first": "$customer_name"},
-                "customer_phone": {"$first": "$customer_phone"},
                 "total_orders": {"$sum": 1},
-                "total_spent": {"$sum": "$final_amount"},
+                "total_spent": {"$sum": ORDER_FINAL_AMOUNT},
                 "first_order_date": {"$min": "$created_at"},
-                "last_order_date": {"$max": "$created_at"},
-                "orders": {"$push": "$$ROOT"}
+                "last_order_date": {"$max": "$created_at"}
+            }
+        },
+        {"$sort": {"total_spent": -1, "_id": 1}},
+        {"$skip": skip},
+        {"$limit": limit},
+        {
+            "$lookup": {
+                "from": "orders",
+                "localField": "_id",
+                "foreignField": "customer_phone",
+                "pipeline": [
+                    {"$unwind": "$items"},
+                    {
+                        "$group": {
+                            "_id": "$items.product_id",
+                            "product_name": {"$first": "$items.product_name"},
+                            "quantity": {"$sum": "$items.quantity"}
+                        }
+                    },
+                    {
+                        "$lookup": {
+                            "from": "products",
+                            "localField": "_id",
+                            "foreignField": "id",
+                            "pipeline": [{"$project": {"_id": 0, "category": 1}}],
+                            "as": "product"
+                        }
+                    },
+                    {
+                        "$project": {
+                            "_id": 0,
+                            "product_name": 1,
+                            "quantity": 1,
+                            "category": {"$first": "$product.category"}
+                        }
+                    },
+                    {"$sort": {"quantity": -1, "product_name": 1}}
+                ],
+                "as": "products"
             }
         }
     ]
     
-    customer_data = await db.orders.aggregate(pipeline).to_list(1000)
-    
     analytics = []
-    for customer in customer_data:
+    async for customer in db.orders.aggregate(pipeline, allowDiskUse=True):
         avg_order_value = customer["total_spent"] / customer["total_orders"]
         
         # Calculate days between first and last order
@@ -519,23 +811,34 @@ async def get_customer_analytics(admin_key: str = Depends(verify_admin)):
         # Determine customer type
         customer_type = CustomerType.RETURNING if customer["total_orders"] > 1 else CustomerType.NEW
         
+        # Favourites by quantity ordered; products arrive sorted by quantity
+        category_quantities = {}
+        for product in customer["products"]:
+            if product.get("category"):
+                category_quantities[product["category"]] = (
+                    category_quantities.get(product["category"], 0) + product["quantity"]
+                )
+        favorite_categories = sorted(category_quantities, key=category_quantities.get, reverse=True)
+        
         analytics.append(CustomerAnalytics(
             customer_id=customer["_id"],
             customer_name=customer["customer_name"],
-            customer_phone=customer["customer_phone"],
+            customer_phone=customer["_id"],
             customer_type=customer_type,
             total_orders=customer["total_orders"],
             total_spent=customer["total_spent"],
             avg_order_value=avg_order_value,
             first_order_date=customer["first_order_date"],
             last_order_date=customer["last_order_date"],
-            avg_time_between_orders=avg_time_between_orders
+            avg_time_between_orders=avg_time_between_orders,
+            favorite_products=[p["product_name"] for p in customer["products"][:favorites_limit]],
+            favorite_categories=favorite_categories[:favorites_limit]
         ))
     
-    return sorted(analytics, key=lambda x: x.total_spent, reverse=True)
+    return analytics
 
 @router.get("/analytics/cart-abandonment")
-async def get_cart_abandonment_analytics(admin_key: str = Depends(verify_admin)):
+async def get_cart_abandonment_analytics(admin_key: str = Depends(verify_admin), db: AsyncIOMotorDatabase = Depends(get_db)):
     """Get cart abandonment analytics and recovery opportunities"""
     # Get recent cart abandonments (last 7 days)
     seven_days_ago = datetime.utcnow() - timedelta(days=7)
@@ -551,7 +854,8 @@ async def get_cart_abandonment_analytics(admin_key: str = Depends(verify_admin))
 async def get_revenue_report(
     date_from: Optional[str] = None,
     date_to: Optional[str] = None,
-    admin_key: str = Depends(verify_admin)
+    admin_key: str = Depends(verify_admin),
+    db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """Get detailed revenue report with delivery costs breakdown"""
     # Set default date range (last 30 days)
@@ -562,31 +866,24 @@ async def get_revenue_report(
         date_from_dt = datetime.fromisoformat(date_from)
         date_to_dt = datetime.fromisoformat(date_to)
     
-    # Revenue aggregation pipeline
-    pipeline = [
-        {
-            "$match": {
-                "created_at": {"$gte": date_from_dt, "$lte": date_to_dt},
-                "status": {"$ne": "cancelled"}
-            }
-        },
+    # Read the materialized daily_revenue cube: one document per day and
+    # delivery status, whatever the number of orders behind it
+    cells = db.daily_revenue.find(
+        {"date": {"$gte": order_day(date_from_dt), "$lte": order_day(date_to_dt)}},
+        {"_id": 0, "refreshed_at": 0}
+    ).sort([("date", -1), ("delivery_status", 1)])
+    
+    revenue_data = [
         {
-            "$group": {
-                "_id": {
-                    "date": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}},
-                    "status": "$delivery_status"
-                },
-                "total_orders": {"$sum": 1},
-                "total_revenue": {"$sum": "$total_amount"},
-                "total_delivery_cost": {"$sum": "$delivery_cost"},
-                "final_amount": {"$sum": "$final_amount"}
-            }
-        },
-        {"$sort": {"_id.date": -1}}
+            "_id": {"date": cell["date"], "status": cell["delivery_status"]},
+            "total_orders": cell["total_orders"],
+            "total_revenue": cell["total_revenue"],
+            "total_delivery_cost": cell["total_delivery_cost"],
+            "final_amount": cell["final_amount"]
+        }
+        async for cell in cells
     ]
     
-    revenue_data = await db.orders.aggregate(pipeline).to_list(1000)
-    
     return {
         "date_range": f"{date_from_dt.strftime('%Y-%m-%d')} to {date_to_dt.strftime('%Y-%m-%d')}",
         "daily_breakdown": revenue_data,
@@ -606,32 +903,33 @@ async def track_visitor_session(
     visitor_type: Optional[str] = "anonymous",
     referral_link_token: Optional[str] = None,
     ip_address: Optional[str] = None,
-    user_agent: Optional[str] = None
+    user_agent: Optional[str] = None,
+    db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """Track visitor session (no admin auth required)"""
-    session_data = {
-        "session_id": session_id,
-        "visitor_type": visitor_type,
-        "referral_link_token": referral_link_token,
-        "ip_address": ip_address,
-        "user_agent": user_agent,
-        "first_visit": datetime.utcnow(),
-        "last_activity": datetime.utcnow()
-    }
-    
-    # Check if session already exists
-    existing_session = await db.visitor_sessions.find_one({"session_id": session_id})
-    
-    if existing_session:
-        await db.visitor_sessions.update_one(
-            {"session_id": session_id},
-            {"$set": {"last_activity": datetime.utcnow()}}
-        )
-    else:
-        await db.visitor_sessions.insert_one(session_data)
+    # One upsert: creates the session on its first hit, otherwise bumps last_activity
+    await record_heartbeat(
+        db, session_id,
+        visitor_type=visitor_type,
+        referral_link_token=referral_link_token,
+        ip_address=ip_address,
+        user_agent=user_agent
+    )
     
     return {"status": "tracked"}
 
+@router.post("/track/visitor-sessions")
+async def track_visitor_sessions(
+    heartbeats: List[SessionHeartbeat],
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """Track a batch of visitor session heartbeats (no admin auth required)"""
+    if len(heartbeats) > MAX_TRACKING_BATCH:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_TRACKING_BATCH} heartbeats per batch")
+    
+    sessions = await record_heartbeats(db, [heartbeat.dict() for heartbeat in heartbeats])
+    return {"status": "tracked", "sessions": sessions}
+
 @router.post("/track/visitor-event")
 async def track_visitor_event(
     session_id: str,
@@ -640,7 +938,8 @@ async def track_visitor_event(
     product_id: Optional[str] = None,
     product_name: Optional[str] = None,
     cart_value: Optional[float] = None,
-    order_id: Optional[str] = None
+    order_id: Optional[str] = None,
+    visitor_event_buffer: VisitorEventBuffer = Depends(get_visitor_event_buffer)
 ):
     """Track visitor events (no admin auth required)"""
     event_data = {
@@ -655,43 +954,7 @@ async def track_visitor_event(
         "timestamp": datetime.utcnow()
     }
     
-    await db.visitor_events.insert_one(event_data)
-    
-    # Update visitor session based on event type
-    if event_type == "page_view":
-        await db.visitor_sessions.update_one(
-            {"session_id": session_id},
-            {
-                "$inc": {"total_page_views": 1},
-                "$set": {"last_activity": datetime.utcnow()}
-            }
-        )
-    elif event_type == "cart_add":
-        await db.visitor_sessions.update_one(
-            {"session_id": session_id},
-            {
-                "$inc": {"items_added_to_cart": 1},
-                "$set": {"last_activity": datetime.utcnow()}
-            }
-        )
-    elif event_type == "checkout_start":
-        await db.visitor_sessions.update_one(
-            {"session_id": session_id},
-            {
-                "$inc": {"checkout_attempts": 1},
-                "$set": {"last_activity": datetime.utcnow()}
-            }
-        )
-    elif event_type == "order_complete":
-        await db.visitor_sessions.update_one(
-            {"session_id": session_id},
-            {
-                "$inc": {"orders_placed": 1, "total_order_value": cart_value or 0},
-                "$set": {
-                    "last_activity": datetime.utcnow(),
-                    "converted_to_customer": True
-                }
-            }
-        )
+    # Acknowledge immediately; the buffer batches the Mongo writes
+    await visitor_event_buffer.put(event_data)
     
     return {"status": "tracked"}
\ No newline at end of file
@@ -0,0 +1,40 @@
+from fastapi import APIRouter, Depends, Header, Response
+from typing import Optional
+import os
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from database import get_db
+from models.admin_models import ProductStatus
+from services.catalog_cache import catalog_cache
+
+router = APIRouter(prefix="/products", tags=["catalog"])
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against our ETag"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+# PUBLIC CATALOG ENDPOINTS
+
+@router.get("")
+async def get_catalog(
+    category: Optional[str] = None,
+    status: Optional[ProductStatus] = None,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """Public product catalog with computed prices (no admin auth required)"""
+    body, etag = await catalog_cache.get_listing(db, category, status)
+    
+    max_age = int(os.environ.get('CATALOG_CACHE_MAX_AGE', 60))
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={max_age}, stale-while-revalidate={max_age * 5}"
+    }
+    
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
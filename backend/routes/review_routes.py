@@ -2,24 +2,67 @@ from fastapi import APIRouter, HTTPException, Query, Depends
 from typing import List, Optional
 from datetime import datetime, timedelta
 import os
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from database import get_db
+from services.projections import partial_model, projection, select_fields
+from services.responses import model_list_response
+from services.templates import CompiledTemplate
+from services.ttl_cache import TTLCache
 from models.review_models import (
     ReviewRequest, CustomerReview, ReviewRequestCreate, 
     ReviewRequestBatch, ReviewStats, ReviewRequestSummary, CustomContactInfo
 )
+from pymongo.errors import BulkWriteError
+import asyncio
 import urllib.parse
 
 router = APIRouter(prefix="/api", tags=["reviews"])
 
-# MongoDB connection
-MONGO_URL = os.environ.get('MONGO_URL')
-DB_NAME = os.environ.get('DB_NAME', 'diwali_delights')
+DUPLICATE_KEY_ERROR = 11000
 
-if not MONGO_URL:
-    raise ValueError("MONGO_URL environment variable is required")
+# Review stats are cached briefly and dropped whenever requests change
+REVIEW_STATS_KEY = "review_stats"
+review_stats_cache = TTLCache(ttl=float(os.environ.get('REVIEW_STATS_TTL_SECONDS', 30)), maxsize=1)
 
-client = AsyncIOMotorClient(MONGO_URL)
-db = client[DB_NAME]
+# Review request message, compiled once with its per-channel encodings
+REVIEW_REQUEST_TEMPLATE = CompiledTemplate("""🌟 Dear {customer_name},
+
+Thank you for your recent order from Aparna's Diwali Delights!
+
+We hope you enjoyed: {products}
+
+We would love to hear your feedback! Your review helps us serve you better and helps other customers make informed choices.
+
+Please rate your experience:
+⭐ Taste & Quality
+⭐ Packaging  
+⭐ Delivery Experience
+⭐ Overall Satisfaction
+
+Share your thoughts with us!
+
+Best regards,
+Aparna's Diwali Delights
+📞 +91 9920632654""", variables=["customer_name", "products"])
+REVIEW_EMAIL_SUBJECT = urllib.parse.quote("Review Request - Aparna's Diwali Delights")
+
+# Order fields read when building review requests and links
+REVIEW_ORDER_PROJECTION = projection(
+    ("id", "customer_name", "customer_phone", "customer_email", "created_at", "items.product_name")
+)
+
+def review_message_values(order: dict) -> dict:
+    return {
+        "customer_name": order['customer_name'],
+        "products": ", ".join(item['product_name'] for item in order['items'])
+    }
+
+def review_links(values: dict, whatsapp_number: str, mobile_number: str, email_address: str) -> dict:
+    return {
+        "whatsapp": f"https://wa.me/{whatsapp_number.replace('+', '')}?text={REVIEW_REQUEST_TEMPLATE.render_encoded('whatsapp', values)}",
+        "sms": f"sms:{mobile_number}?body={REVIEW_REQUEST_TEMPLATE.render_encoded('sms', values)}",
+        "email": f"mailto:{email_address}?subject={REVIEW_EMAIL_SUBJECT}&body={REVIEW_REQUEST_TEMPLATE.render_encoded('email', values)}"
+    }
 
 def get_admin_key():
     return os.environ.get('ADMIN_KEY')
@@ -31,51 +74,80 @@ async def verify_admin_key(admin_key: str = Query(...)):
     return admin_key
 
 @router.get("/admin/reviews/summary", response_model=ReviewRequestSummary)
-async def get_review_summary(admin_key: str = Depends(verify_admin_key)):
+async def get_review_summary(
+    limit: int = Query(10, ge=1, le=100),
+    skip: int = Query(0, ge=0),
+    admin_key: str = Depends(verify_admin_key),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
     """Get summary of orders and review request status"""
     try:
-        # Get all orders from the last 30 days
+        # Orders from the last 30 days
         thirty_days_ago = datetime.now() - timedelta(days=30)
-        
-        # Get recent orders
-        orders_cursor = db.orders.find({
+        recent_orders = {
             "created_at": {"$gte": thirty_days_ago},
             "status": {"$in": ["confirmed", "delivered"]}
-        })
-        orders = await orders_cursor.to_list(length=None)
+        }
         
-        # Get existing review requests
-        review_requests_cursor = db.review_requests.find({})
-        review_requests = await review_requests_cursor.to_list(length=None)
+        # Eligible orders: delivered orders without a review request, found
+        # with an anti-join and paginated server-side
+        eligible_pipeline = [
+            {"$match": {**recent_orders, "status": "delivered"}},
+            {
+                "$lookup": {
+                    "from": "review_requests",
+                    "localField": "id",
+                    "foreignField": "order_id",
+                    "pipeline": [{"$limit": 1}, {"$project": {"_id": 1}}],
+                    "as": "review_requests"
+                }
+            },
+            {"$match": {"review_requests": {"$size": 0}}},
+            {
+                "$facet": {
+                    "total": [{"$count": "count"}],
+                    "page": [
+                        {"$sort": {"created_at": -1}},
+                        {"$skip": skip},
+                        {"$limit": limit},
+                        {
+                            "$project": {
+                                "_id": 0,
+                                "order_id": "$id",
+                                "customer_name": 1,
+                                "customer_phone": 1,
+                                "order_date": "$created_at",
+                                "total_amount": 1,
+                                "items": 1
+                            }
+                        }
+                    ]
+                }
+            }
+        ]
         
-        # Get submitted reviews
-        reviews_cursor = db.customer_reviews.find({})
-        reviews = await reviews_cursor.to_list(length=None)
+        # Distinct orders that already have a review request
+        requested_pipeline = [
+            {"$group": {"_id": "$order_id"}},
+            {"$count": "count"}
+        ]
         
-        # Create sets for tracking
-        orders_with_requests = set()
-        for req in review_requests:
-            orders_with_requests.add(req.get('order_id'))
+        total_orders, eligible_result, requested_result, total_reviews = await asyncio.gather(
+            db.orders.count_documents(recent_orders),
+            db.orders.aggregate(eligible_pipeline).to_list(length=1),
+            db.review_requests.aggregate(requested_pipeline).to_list(length=1),
+            db.customer_reviews.count_documents({})
+        )
         
-        # Calculate eligible orders (delivered orders without review requests)
-        eligible_orders = []
-        for order in orders:
-            if order['id'] not in orders_with_requests and order['status'] == 'delivered':
-                eligible_orders.append({
-                    'order_id': order['id'],
-                    'customer_name': order['customer_name'],
-                    'customer_phone': order['customer_phone'],
-                    'order_date': order['created_at'],
-                    'total_amount': order['total_amount'],
-                    'items': order['items']
-                })
+        eligible = eligible_result[0]
+        eligible_total = eligible["total"][0]["count"] if eligible["total"] else 0
         
         return ReviewRequestSummary(
-            total_orders=len(orders),
-            orders_with_requests_sent=len(orders_with_requests),
-            orders_pending_requests=len(eligible_orders),
-            total_reviews_received=len(reviews),
-            orders_eligible_for_requests=eligible_orders[:10]  # Limit to 10 for display
+            total_orders=total_orders,
+            orders_with_requests_sent=requested_result[0]["count"] if requested_result else 0,
+            orders_pending_requests=eligible_total,
+            total_reviews_received=total_reviews,
+            orders_eligible_for_requests=eligible["page"]
         )
     
     except Exception as e:
@@ -84,26 +156,37 @@ async def get_review_summary(admin_key: str = Depends(verify_admin_key)):
 @router.post("/admin/reviews/send-requests", response_model=dict)
 async def send_review_requests(
     request_data: ReviewRequestBatch,
-    admin_key: str = Depends(verify_admin_key)
+    admin_key: str = Depends(verify_admin_key),
+    db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """Send review requests for multiple orders"""
     try:
         success_count = 0
         failed_orders = []
         
+        # Fetch every order and every existing request in two round trips
+        order_ids = list(dict.fromkeys(request_data.order_ids))
+        orders_list, existing_list = await asyncio.gather(
+            db.orders.find({"id": {"$in": order_ids}}, REVIEW_ORDER_PROJECTION).to_list(length=None),
+            db.review_requests.find({"order_id": {"$in": order_ids}}, {"_id": 0, "order_id": 1}).to_list(length=None)
+        )
+        orders = {order['id']: order for order in orders_list}
+        orders_with_requests = {req['order_id'] for req in existing_list}
+        
+        new_requests = []
+        seen = set()
         for order_id in request_data.order_ids:
             try:
-                # Get order details
-                order = await db.orders.find_one({"id": order_id})
+                order = orders.get(order_id)
                 if not order:
                     failed_orders.append({"order_id": order_id, "reason": "Order not found"})
                     continue
                 
-                # Check if review request already exists
-                existing_request = await db.review_requests.find_one({"order_id": order_id})
-                if existing_request:
+                # Check if review request already exists (or is repeated in this batch)
+                if order_id in orders_with_requests or order_id in seen:
                     failed_orders.append({"order_id": order_id, "reason": "Review request already sent"})
                     continue
+                seen.add(order_id)
                 
                 # Extract product names
                 product_names = [item['product_name'] for item in order['items']]
@@ -136,14 +219,28 @@ async def send_review_requests(
                     request_method=request_data.request_method,
                     status="sent"
                 )
-                
-                # Save to database
-                await db.review_requests.insert_one(review_request.dict())
-                success_count += 1
+                new_requests.append(review_request.dict())
                 
             except Exception as e:
                 failed_orders.append({"order_id": order_id, "reason": str(e)})
         
+        # Save to database in one unordered batch; the unique index on
+        # review_requests.order_id rejects requests raced in by another call
+        if new_requests:
+            try:
+                result = await db.review_requests.insert_many(new_requests, ordered=False)
+                success_count = len(result.inserted_ids)
+            except BulkWriteError as e:
+                success_count = e.details.get("nInserted", 0)
+                for error in e.details.get("writeErrors", []):
+                    order_id = new_requests[error["index"]]["order_id"]
+                    if error.get("code") == DUPLICATE_KEY_ERROR:
+                        reason = "Review request already sent"
+                    else:
+                        reason = error.get("errmsg", "Failed to save review request")
+                    failed_orders.append({"order_id": order_id, "reason": reason})
+            review_stats_cache.invalidate(REVIEW_STATS_KEY)
+        
         return {
             "success": True,
             "requests_sent": success_count,
@@ -154,116 +251,136 @@ async def send_review_requests(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error sending review requests: {str(e)}")
 
-@router.get("/admin/reviews/requests", response_model=List[ReviewRequest])
+@router.get("/admin/reviews/requests", response_model=List[partial_model(ReviewRequest)])
 async def get_review_requests(
     status: Optional[str] = Query(None),
     limit: int = Query(50, le=100),
-    admin_key: str = Depends(verify_admin_key)
+    fields: Optional[str] = Query(None, description="Comma-separated ReviewRequest fields, or * for all"),
+    admin_key: str = Depends(verify_admin_key),
+    db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """Get all review requests with optional status filter"""
+    selected = select_fields(ReviewRequest, fields, ReviewRequest.model_fields)
     try:
         filter_query = {}
         if status:
             filter_query["status"] = status
         
-        cursor = db.review_requests.find(filter_query).sort("request_sent_date", -1).limit(limit)
+        cursor = db.review_requests.find(filter_query, projection(selected)).sort("request_sent_date", -1).limit(limit)
         requests = await cursor.to_list(length=None)
         
-        return [ReviewRequest(**req) for req in requests]
+        return model_list_response(ReviewRequest, requests, fields=selected)
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching review requests: {str(e)}")
 
 @router.get("/admin/reviews/stats", response_model=ReviewStats)
-async def get_review_stats(admin_key: str = Depends(verify_admin_key)):
+async def get_review_stats(admin_key: str = Depends(verify_admin_key), db: AsyncIOMotorDatabase = Depends(get_db)):
     """Get review statistics and analytics"""
+    cached = review_stats_cache.get(REVIEW_STATS_KEY)
+    if cached is not None:
+        return cached
+    
     try:
-        # Get review requests
-        requests_cursor = db.review_requests.find({})
-        requests = await requests_cursor.to_list(length=None)
-        
-        # Get submitted reviews
-        reviews_cursor = db.customer_reviews.find({}).sort("review_date", -1).limit(10)
-        reviews = await reviews_cursor.to_list(length=None)
+        # Requests and reviews go through one pass: requests are tagged and
+        # unioned with reviews, then each facet picks the documents it needs
+        pipeline = [
+            {"$project": {"_id": 0, "_kind": {"$literal": "request"}, "review_submitted": 1}},
+            {
+                "$unionWith": {
+                    "coll": "customer_reviews",
+                    "pipeline": [{"$project": {"_id": 0}}, {"$set": {"_kind": {"$literal": "review"}}}]
+                }
+            },
+            {
+                "$facet": {
+                    "requests": [
+                        {"$match": {"_kind": "request"}},
+                        {
+                            "$group": {
+                                "_id": None,
+                                "total": {"$sum": 1},
+                                "completed": {"$sum": {"$cond": [{"$eq": ["$review_submitted", True]}, 1, 0]}}
+                            }
+                        }
+                    ],
+                    "ratings": [
+                        {"$match": {"_kind": "review"}},
+                        {
+                            "$group": {
+                                "_id": None,
+                                "overall": {"$avg": "$overall_rating"},
+                                "taste": {"$avg": "$taste_rating"},
+                                "packaging": {"$avg": "$packaging_rating"},
+                                "delivery": {"$avg": "$delivery_rating"}
+                            }
+                        }
+                    ],
+                    "recent": [
+                        {"$match": {"_kind": "review"}},
+                        {"$sort": {"review_date": -1}},
+                        {"$limit": 10},
+                        {"$unset": "_kind"}
+                    ]
+                }
+            }
+        ]
+        result = (await db.review_requests.aggregate(pipeline).to_list(length=1))[0]
         
         # Calculate stats
-        total_requests = len(requests)
-        completed_reviews = len([r for r in requests if r.get('review_submitted')])
+        requests = result["requests"][0] if result["requests"] else {}
+        total_requests = requests.get("total", 0)
+        completed_reviews = requests.get("completed", 0)
         pending_reviews = total_requests - completed_reviews
         
         response_rate = (completed_reviews / total_requests * 100) if total_requests > 0 else 0
         
-        # Calculate average rating from actual reviews
-        if reviews:
-            avg_rating = sum(r.get('overall_rating', 0) for r in reviews) / len(reviews)
-        else:
-            avg_rating = 0.0
+        # All-time averages from every submitted review
+        ratings = result["ratings"][0] if result["ratings"] else {}
         
-        return ReviewStats(
+        def rounded(value):
+            return round(value, 1) if value is not None else None
+        
+        stats = ReviewStats(
             total_requests_sent=total_requests,
             pending_reviews=pending_reviews,
             completed_reviews=completed_reviews,
             review_response_rate=round(response_rate, 2),
-            average_overall_rating=round(avg_rating, 1),
-            recent_reviews=[CustomerReview(**review) for review in reviews]
+            average_overall_rating=rounded(ratings.get("overall")) or 0.0,
+            average_taste_rating=rounded(ratings.get("taste")),
+            average_packaging_rating=rounded(ratings.get("packaging")),
+            average_delivery_rating=rounded(ratings.get("delivery")),
+            recent_reviews=[CustomerReview(**review) for review in result["recent"]]
         )
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching review stats: {str(e)}")
+    
+    review_stats_cache.set(REVIEW_STATS_KEY, stats)
+    return stats
 
 @router.get("/admin/reviews/generate-links/{order_id}")
 async def generate_review_links(
     order_id: str,
-    admin_key: str = Depends(verify_admin_key)
+    admin_key: str = Depends(verify_admin_key),
+    db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """Generate WhatsApp, SMS, and email links for manual review requests"""
     try:
         # Get order details
-        order = await db.orders.find_one({"id": order_id})
+        order = await db.orders.find_one({"id": order_id}, REVIEW_ORDER_PROJECTION)
         if not order:
             raise HTTPException(status_code=404, detail="Order not found")
         
-        customer_name = order['customer_name']
-        products = [item['product_name'] for item in order['items']]
-        products_text = ", ".join(products)
-        
-        # Base message template
-        message = f"""🌟 Dear {customer_name},
-
-Thank you for your recent order from Aparna's Diwali Delights!
-
-We hope you enjoyed: {products_text}
-
-We would love to hear your feedback! Your review helps us serve you better and helps other customers make informed choices.
-
-Please rate your experience:
-⭐ Taste & Quality
-⭐ Packaging  
-⭐ Delivery Experience
-⭐ Overall Satisfaction
-
-Share your thoughts with us!
-
-Best regards,
-Aparna's Diwali Delights
-📞 +91 9920632654"""
-        
-        # Generate links
-        whatsapp_message = urllib.parse.quote(message)
-        sms_message = urllib.parse.quote(message.replace("🌟", "").replace("⭐", "*"))
-        email_subject = urllib.parse.quote("Review Request - Aparna's Diwali Delights")
-        email_body = urllib.parse.quote(message.replace("🌟", "").replace("⭐", "*"))
-        
+        values = review_message_values(order)
         return {
             "order_id": order_id,
-            "customer_name": customer_name,
+            "customer_name": order['customer_name'],
             "customer_phone": order['customer_phone'],
-            "links": {
-                "whatsapp": f"https://wa.me/{order['customer_phone'].replace('+', '')}?text={whatsapp_message}",
-                "sms": f"sms:{order['customer_phone']}?body={sms_message}",
-                "email": f"mailto:{order.get('customer_email', '')}?subject={email_subject}&body={email_body}"
-            },
-            "message_preview": message
+            "links": review_links(
+                values, order['customer_phone'], order['customer_phone'], order.get('customer_email', '')
+            ),
+            "message_preview": REVIEW_REQUEST_TEMPLATE.render(values)
         }
     
     except Exception as e:
@@ -273,7 +390,8 @@ Aparna's Diwali Delights
 async def update_review_request_status(
     request_id: str,
     status: str = Query(...),
-    admin_key: str = Depends(verify_admin_key)
+    admin_key: str = Depends(verify_admin_key),
+    db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """Update the status of a review request"""
     try:
@@ -295,6 +413,7 @@ async def update_review_request_status(
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="Review request not found")
         
+        review_stats_cache.invalidate(REVIEW_STATS_KEY)
         return {"success": True, "message": f"Review request status updated to {status}"}
     
     except Exception as e:
@@ -304,61 +423,28 @@ async def update_review_request_status(
 async def generate_custom_review_links(
     order_id: str,
     custom_contact: CustomContactInfo,
-    admin_key: str = Depends(verify_admin_key)
+    admin_key: str = Depends(verify_admin_key),
+    db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """Generate WhatsApp, SMS, and email links with custom contact information"""
     try:
         # Get order details
-        order = await db.orders.find_one({"id": order_id})
+        order = await db.orders.find_one({"id": order_id}, REVIEW_ORDER_PROJECTION)
         if not order:
             raise HTTPException(status_code=404, detail="Order not found")
         
-        customer_name = order['customer_name']
-        products = [item['product_name'] for item in order['items']]
-        products_text = ", ".join(products)
-        
-        # Base message template
-        message = f"""🌟 Dear {customer_name},
-
-Thank you for your recent order from Aparna's Diwali Delights!
-
-We hope you enjoyed: {products_text}
-
-We would love to hear your feedback! Your review helps us serve you better and helps other customers make informed choices.
-
-Please rate your experience:
-⭐ Taste & Quality
-⭐ Packaging  
-⭐ Delivery Experience
-⭐ Overall Satisfaction
-
-Share your thoughts with us!
-
-Best regards,
-Aparna's Diwali Delights
-📞 +91 9920632654"""
-        
-        # Generate links with custom contact info
-        whatsapp_message = urllib.parse.quote(message)
-        sms_message = urllib.parse.quote(message.replace("🌟", "").replace("⭐", "*"))
-        email_subject = urllib.parse.quote("Review Request - Aparna's Diwali Delights")
-        email_body = urllib.parse.quote(message.replace("🌟", "").replace("⭐", "*"))
-        
         # Use custom contact info if provided, otherwise fallback to order info
         whatsapp_number = custom_contact.whatsapp_number or order['customer_phone']
         mobile_number = custom_contact.mobile_number or order['customer_phone']
         email_address = custom_contact.email_id or order.get('customer_email', '')
         
+        values = review_message_values(order)
         return {
             "order_id": order_id,
-            "customer_name": customer_name,
+            "customer_name": order['customer_name'],
             "custom_contact": custom_contact.dict(),
-            "links": {
-                "whatsapp": f"https://wa.me/{whatsapp_number.replace('+', '')}?text={whatsapp_message}",
-                "sms": f"sms:{mobile_number}?body={sms_message}",
-                "email": f"mailto:{email_address}?subject={email_subject}&body={email_body}"
-            },
-            "message_preview": message
+            "links": review_links(values, whatsapp_number, mobile_number, email_address),
+            "message_preview": REVIEW_REQUEST_TEMPLATE.render(values)
         }
     
     except Exception as e:
@@ -0,0 +1,141 @@
+from fastapi import APIRouter, Depends, HTTPException, Request
+from typing import Annotated, List, Union
+from datetime import datetime, timezone
+import asyncio
+import json
+import logging
+import os
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pydantic import Field, TypeAdapter, ValidationError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from database import get_db
+from models.admin_models import BatchLinkEvent, BatchVisitorEvent, LinkTracking, VisitorEvent
+from services.event_buffer import build_session_updates
+from services.link_stats import build_link_stats_update
+from services.link_tokens import link_token_cache
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/track", tags=["tracking"])
+
+# Upper bound on items accepted by the unauthenticated batch tracking endpoints
+MAX_TRACKING_BATCH = int(os.environ.get('MAX_TRACKING_BATCH', 500))
+
+_batch_item = TypeAdapter(Annotated[Union[BatchVisitorEvent, BatchLinkEvent], Field(discriminator="kind")])
+
+def event_time(timestamp: datetime, received_at: datetime) -> datetime:
+    """Client timestamps as naive UTC, never later than when the batch arrived"""
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return min(timestamp, received_at)
+
+async def insert_events(collection, events: List[dict]) -> set:
+    """Insert events unordered and return the positions that failed"""
+    if not events:
+        return set()
+    try:
+        await collection.insert_many(events, ordered=False)
+    except BulkWriteError as e:
+        return {error["index"] for error in e.details.get("writeErrors", [])}
+    except Exception:
+        logger.exception("Failed to insert %d %s documents", len(events), collection.name)
+        return set(range(len(events)))
+    return set()
+
+async def apply_rollups(collection, updates: List[UpdateOne]):
+    if not updates:
+        return
+    try:
+        await collection.bulk_write(updates, ordered=False)
+    except Exception:
+        logger.exception("Failed to apply %d %s updates", len(updates), collection.name)
+
+# PUBLIC TRACKING ENDPOINTS
+
+@router.post("/batch")
+async def track_batch(request: Request, db: AsyncIOMotorDatabase = Depends(get_db)):
+    """Track a batch of visitor and link events (no admin auth required).
+
+    The body is a JSON array of items tagged ``"kind": "visitor"`` or
+    ``"kind": "link"``. It is parsed regardless of Content-Type so pages can
+    flush with ``navigator.sendBeacon``. Each collection gets one bulk write
+    and every item gets its own status.
+    """
+    try:
+        items = json.loads(await request.body())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Body must be a JSON array")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Body must be a JSON array")
+    if len(items) > MAX_TRACKING_BATCH:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_TRACKING_BATCH} events per batch")
+
+    received_at = datetime.utcnow()
+    results = [{"index": index, "status": "stored"} for index in range(len(items))]
+    visitor_events, visitor_positions = [], []
+    link_items, link_positions = [], []
+
+    for index, item in enumerate(items):
+        try:
+            event = _batch_item.validate_python(item)
+        except ValidationError as e:
+            results[index] = {"index": index, "status": "rejected", "detail": e.errors(include_url=False)}
+            continue
+        event.timestamp = event_time(event.timestamp, received_at)
+        if isinstance(event, BatchVisitorEvent):
+            visitor_events.append(VisitorEvent(**event.dict(exclude={"kind"})).dict())
+            visitor_positions.append(index)
+        else:
+            link_items.append(event)
+            link_positions.append(index)
+
+    # Resolve each distinct link token once (cached across requests)
+    tokens = list({event.link_token for event in link_items})
+    links = dict(zip(tokens, await asyncio.gather(*(link_token_cache.resolve(db, token) for token in tokens))))
+
+    user_agent = request.headers.get("user-agent")
+    client_ip = request.client.host if request.client else None
+    link_events, link_event_positions = [], []
+    for index, event in zip(link_positions, link_items):
+        link = links[event.link_token]
+        if not link:
+            results[index] = {"index": index, "status": "rejected", "detail": "Invalid or expired link"}
+            continue
+        link_events.append(LinkTracking(
+            link_id=link.link_id,
+            contact_id=link.contact_id,
+            event_type=event.event_type,
+            page_url=event.page_url,
+            product_id=event.product_id,
+            timestamp=event.timestamp,
+            user_agent=event.user_agent or user_agent,
+            ip_address=event.ip_address or client_ip
+        ).dict())
+        link_event_positions.append(index)
+
+    failed_visitor, failed_link = await asyncio.gather(
+        insert_events(db.visitor_events, visitor_events),
+        insert_events(db.link_tracking, link_events)
+    )
+    for failed, positions in ((failed_visitor, visitor_positions), (failed_link, link_event_positions)):
+        for position in failed:
+            results[positions[position]] = {"index": positions[position], "status": "failed"}
+
+    # Roll the stored events into visitor sessions and link stats
+    stored_visitor = [event for i, event in enumerate(visitor_events) if i not in failed_visitor]
+    stored_link = [event for i, event in enumerate(link_events) if i not in failed_link]
+    await asyncio.gather(
+        apply_rollups(db.visitor_sessions, build_session_updates(stored_visitor)),
+        apply_rollups(db.link_stats, [
+            UpdateOne({"link_id": event["link_id"]}, build_link_stats_update(event), upsert=True)
+            for event in stored_link
+        ])
+    )
+
+    return {
+        "stored": len(stored_visitor) + len(stored_link),
+        "rejected": sum(1 for result in results if result["status"] == "rejected"),
+        "failed": len(failed_visitor) + len(failed_link),
+        "results": results
+    }
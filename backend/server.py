@@ -1,8 +1,9 @@
-from fastapi import FastAPI, APIRouter
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, APIRouter, Depends
+from fastapi.responses import ORJSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from contextlib import asynccontextmanager
 import os
 import logging
 from pathlib import Path
@@ -10,23 +11,81 @@ from pydantic import BaseModel, Field
 from typing import List
 import uuid
 from datetime import datetime
+from database import mongo, get_db
+from services.catalog_cache import catalog_cache
+from services.event_buffer import VisitorEventBuffer
+from services.event_rollups import EventRollupJob, retention_period
+from services.indexes import apply_indexes
+from services.link_tokens import link_token_cache
+from services.revenue_cube import RevenueCubeRefresher
+from services.timeseries import ensure_timeseries_collections, timeseries_enabled, timeseries_granularity
+from services.images import UploadStaticFiles, shutdown_image_workers
 
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One MongoDB client per process, shared by every router via get_db
+    db = mongo.connect()
+    if timeseries_enabled():
+        await ensure_timeseries_collections(db, timeseries_granularity())
+    await apply_indexes(db)
+    
+    # How often each worker checks whether another worker changed the catalog
+    catalog_cache.check_interval = float(os.environ.get('CATALOG_VERSION_CHECK_SECONDS', 5))
+    
+    # Tracking calls resolve link tokens through a per-worker cache
+    link_token_cache.configure(
+        ttl=float(os.environ.get('LINK_TOKEN_CACHE_TTL_SECONDS', 60)),
+        negative_ttl=float(os.environ.get('LINK_TOKEN_NEGATIVE_TTL_SECONDS', 30)),
+        maxsize=int(os.environ.get('LINK_TOKEN_CACHE_SIZE', 10000)),
+    )
+    
+    # Write-behind buffer for storefront visitor events
+    app.state.visitor_event_buffer = VisitorEventBuffer(
+        db,
+        max_batch_size=int(os.environ.get('VISITOR_EVENT_BATCH_SIZE', 500)),
+        flush_interval=float(os.environ.get('VISITOR_EVENT_FLUSH_INTERVAL', 1.0)),
+        max_pending=int(os.environ.get('VISITOR_EVENT_MAX_PENDING', 10000)),
+    )
+    await app.state.visitor_event_buffer.start()
+    
+    # Keeps the daily_revenue cube in step with orders changed outside update_order
+    app.state.revenue_cube_refresher = RevenueCubeRefresher(
+        db,
+        interval=float(os.environ.get('REVENUE_CUBE_REFRESH_SECONDS', 300)),
+    )
+    await app.state.revenue_cube_refresher.start()
+    
+    # Rolls raw tracking events into hourly/daily rollups and switches on their
+    # expiry once everything stored has been rolled up
+    app.state.event_rollup_job = EventRollupJob(
+        db,
+        interval=float(os.environ.get('EVENT_ROLLUP_INTERVAL_SECONDS', 900)),
+        retention=retention_period(),
+    )
+    await app.state.event_rollup_job.start()
+    
+    yield
+    
+    await shutdown_db_client(app)
+
+async def shutdown_db_client(app: FastAPI):
+    await app.state.event_rollup_job.stop()
+    await app.state.revenue_cube_refresher.stop()
+    await app.state.visitor_event_buffer.stop()
+    mongo.close()
+    shutdown_image_workers()
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Create uploads directory and serve static files
 uploads_dir = Path("/app/uploads")
 uploads_dir.mkdir(exist_ok=True)
-app.mount("/uploads", StaticFiles(directory="/app/uploads"), name="uploads")
+app.mount("/uploads", UploadStaticFiles(directory="/app/uploads"), name="uploads")
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -47,14 +106,14 @@ async def root():
     return {"message": "Hello World"}
 
 @api_router.post("/status", response_model=StatusCheck)
-async def create_status_check(input: StatusCheckCreate):
+async def create_status_check(input: StatusCheckCreate, db: AsyncIOMotorDatabase = Depends(get_db)):
     status_dict = input.dict()
     status_obj = StatusCheck(**status_dict)
     _ = await db.status_checks.insert_one(status_obj.dict())
     return status_obj
 
 @api_router.get("/status", response_model=List[StatusCheck])
-async def get_status_checks():
+async def get_status_checks(db: AsyncIOMotorDatabase = Depends(get_db)):
     status_checks = await db.status_checks.find().to_list(1000)
     return [StatusCheck(**status_check) for status_check in status_checks]
 
@@ -62,6 +121,14 @@ async def get_status_checks():
 from routes.admin_routes import router as admin_router
 api_router.include_router(admin_router)
 
+# Include public catalog routes in api_router
+from routes.catalog_routes import router as catalog_router
+api_router.include_router(catalog_router)
+
+# Include public batch tracking routes in api_router
+from routes.tracking_routes import router as tracking_router
+api_router.include_router(tracking_router)
+
 # Include review routes
 from routes.review_routes import router as review_router
 app.include_router(review_router)
@@ -75,6 +142,7 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor", "X-Total-Count", "X-Campaign-Id"],
 )
 
 # Configure logging
@@ -83,7 +151,3 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
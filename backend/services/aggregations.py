@@ -0,0 +1,16 @@
+"""Aggregation expressions shared by the analytics endpoints and rollup jobs"""
+
+# An order's final amount. OrderEnhanced only exposes final_amount as a
+# property, so it is derived from total_amount + delivery_cost unless stored.
+ORDER_FINAL_AMOUNT = {
+    "$ifNull": [
+        "$final_amount",
+        {"$add": [
+            {"$ifNull": ["$total_amount", 0]},
+            {"$ifNull": ["$delivery_cost", 0]}
+        ]}
+    ]
+}
+
+# Calendar day (UTC) an order was placed, as used for daily rollups
+ORDER_DAY = {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}}
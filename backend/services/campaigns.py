@@ -0,0 +1,106 @@
+"""Bulk personalized-message campaigns for ``POST /admin/campaigns``.
+
+Recipients are read from a cursor and handled ``CAMPAIGN_CHUNK_SIZE`` at a
+time: each chunk gets its personalized links from one ``insert_many``, its
+messages rendered from the compiled template and ``last_contacted`` set by
+one ``update_many``. Results are yielded as NDJSON lines as soon as their
+chunk is written.
+"""
+import json
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Optional
+
+from services.contact_import import normalize_phone
+from services.templates import CompiledTemplate
+
+CAMPAIGN_CHUNK_SIZE = 1000
+
+
+def personalized_url(link_token: str) -> str:
+    domain = os.environ.get('APP_DOMAIN', 'localhost:3000')
+    protocol = 'https' if 'localhost' not in domain else 'http'
+    return f"{protocol}://{domain}/?ref={link_token}"
+
+
+def message_links(compiled: CompiledTemplate, values: dict, phone: str, email: Optional[str] = None) -> dict:
+    """Click-to-send WhatsApp/SMS (and email) links carrying the rendered message"""
+    links = {
+        "whatsapp": f"https://wa.me/{phone.replace('+', '')}?text={compiled.render_encoded('whatsapp', values)}",
+        "sms": f"sms:{phone}?body={compiled.render_encoded('sms', values)}",
+    }
+    if email is not None:
+        links["email"] = f"mailto:{email}?body={compiled.render_encoded('email', values)}"
+    return links
+
+
+def dialable_phone(contact: dict) -> str:
+    """International form of a contact's phone; wa.me rejects local numbers"""
+    return contact.get("phone_normalized") or normalize_phone(contact["phone"]) or contact["phone"]
+
+
+def build_link(contact_id: str, message: str, now: datetime,
+               expires_in_days: Optional[int], campaign_id: Optional[str] = None) -> dict:
+    link = {
+        "id": str(uuid.uuid4()),
+        "contact_id": contact_id,
+        "link_token": str(uuid.uuid4().hex),
+        "message": message,
+        "created_at": now,
+        "expires_at": now + timedelta(days=expires_in_days) if expires_in_days else None,
+        "is_active": True
+    }
+    if campaign_id:
+        link["campaign_id"] = campaign_id
+    return link
+
+
+async def _send_chunk(db, contacts, template: dict, compiled: CompiledTemplate, campaign_id: str,
+                      expires_in_days: Optional[int]) -> str:
+    now = datetime.utcnow()
+    links = [build_link(contact["id"], template["message"], now, expires_in_days, campaign_id)
+             for contact in contacts]
+    await db.personalized_links.insert_many(links, ordered=False)
+    await db.contacts.update_many(
+        {"id": {"$in": [contact["id"] for contact in contacts]}},
+        {"$set": {"last_contacted": now}}
+    )
+
+    lines = []
+    for contact, link in zip(contacts, links):
+        url = personalized_url(link["link_token"])
+        values = {"name": contact["name"], "link": url}
+        lines.append(json.dumps({
+            "contact_id": contact["id"],
+            "contact_name": contact["name"],
+            "contact_phone": contact["phone"],
+            "message": compiled.render(values),
+            "links": message_links(compiled, values, dialable_phone(contact), contact.get("email")),
+            "link_id": link["id"],
+            "personalized_url": url,
+            "status": "ready_to_send"
+        }))
+    return "\n".join(lines) + "\n"
+
+
+async def run_campaign(db, campaign: dict, template: dict, compiled: CompiledTemplate,
+                       contact_query: dict, expires_in_days: Optional[int]) -> AsyncIterator[str]:
+    """Create links for every matching contact, yielding NDJSON results per chunk"""
+    sent = 0
+    chunk = []
+    cursor = db.contacts.find(contact_query, {"_id": 0, "id": 1, "name": 1, "phone": 1, "phone_normalized": 1, "email": 1})
+    async for contact in cursor.batch_size(CAMPAIGN_CHUNK_SIZE):
+        chunk.append(contact)
+        if len(chunk) >= CAMPAIGN_CHUNK_SIZE:
+            yield await _send_chunk(db, chunk, template, compiled, campaign["id"], expires_in_days)
+            sent += len(chunk)
+            chunk = []
+    if chunk:
+        yield await _send_chunk(db, chunk, template, compiled, campaign["id"], expires_in_days)
+        sent += len(chunk)
+
+    await db.campaigns.update_one(
+        {"id": campaign["id"]},
+        {"$set": {"recipients": sent, "completed_at": datetime.utcnow()}}
+    )
@@ -0,0 +1,114 @@
+"""Process-local cache of the product catalog.
+
+The catalog is a few dozen products that change a few times a day, so each
+worker keeps the validated ``Product`` objects and their serialized JSON in
+memory. Writes go through ``invalidate``, which drops the local copy and bumps
+a version counter in ``cache_versions``; other workers compare that counter
+at most every ``check_interval`` seconds and reload when it has moved.
+"""
+import asyncio
+import hashlib
+import json
+import time
+from typing import Dict, List, Optional, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from models.admin_models import Product, ProductStatus
+
+CATALOG_VERSION_KEY = "products"
+MAX_LISTINGS = 256
+
+_products_adapter = TypeAdapter(List[Product])
+
+
+class CatalogCache:
+    """Validated products keyed by id plus the serialized product list"""
+
+    def __init__(self, check_interval: float = 5.0):
+        self.check_interval = check_interval
+        self.version = None
+        self._products: Optional[Dict[str, Product]] = None
+        self._serialized: Optional[bytes] = None
+        self._listings: Dict[tuple, Tuple[bytes, str]] = {}
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def _is_fresh(self) -> bool:
+        return self._products is not None and time.monotonic() - self._checked_at < self.check_interval
+
+    async def _current_version(self, db) -> int:
+        doc = await db.cache_versions.find_one({"_id": CATALOG_VERSION_KEY})
+        return doc["version"] if doc else 0
+
+    async def _ensure_fresh(self, db):
+        if self._is_fresh():
+            return
+        async with self._lock:
+            if self._is_fresh():
+                return
+            # Read the version before the products so a concurrent write is
+            # picked up by the next check rather than masked
+            version = await self._current_version(db)
+            if self._products is None or version != self.version:
+                docs = await db.products.find().to_list(None)
+                products = [Product(**doc) for doc in docs]
+                self._products = {product.id: product for product in products}
+                self._serialized = _products_adapter.dump_json(products)
+                self._listings = {}
+                self.version = version
+            self._checked_at = time.monotonic()
+
+    async def get_all(self, db) -> List[Product]:
+        await self._ensure_fresh(db)
+        return list(self._products.values())
+
+    async def get_serialized(self, db) -> bytes:
+        """The whole catalog as a JSON array, serialized once per version"""
+        await self._ensure_fresh(db)
+        return self._serialized
+
+    async def get(self, db, product_id: str) -> Optional[Product]:
+        await self._ensure_fresh(db)
+        return self._products.get(product_id)
+
+    async def get_listing(self, db, category: Optional[str] = None,
+                          status: Optional[ProductStatus] = None) -> Tuple[bytes, str]:
+        """Public catalog JSON and its strong ETag for one filter combination.
+
+        Without a status filter inactive products are left out. Each listing
+        carries the computed ``final_price``/``has_offer`` and is built once
+        per catalog version.
+        """
+        await self._ensure_fresh(db)
+        key = (category, status)
+        listing = self._listings.get(key)
+        if listing is None:
+            products = [
+                {**jsonable_encoder(product), "final_price": product.final_price, "has_offer": product.has_offer}
+                for product in self._products.values()
+                if (category is None or product.category == category)
+                and (product.status == status if status else product.status != ProductStatus.INACTIVE)
+            ]
+            body = json.dumps(products, separators=(",", ":")).encode()
+            etag = '"%s-%s"' % (self.version, hashlib.sha1(body).hexdigest()[:20])
+            if len(self._listings) >= MAX_LISTINGS:
+                # Arbitrary category strings must not grow the cache unbounded
+                self._listings = {}
+            listing = self._listings[key] = (body, etag)
+        return listing
+
+    async def invalidate(self, db):
+        """Drop the local copy and signal every other worker to reload"""
+        await db.cache_versions.update_one(
+            {"_id": CATALOG_VERSION_KEY},
+            {"$inc": {"version": 1}},
+            upsert=True
+        )
+        self._products = None
+        self._serialized = None
+        self._listings = {}
+
+
+catalog_cache = CatalogCache()
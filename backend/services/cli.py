@@ -0,0 +1,29 @@
+"""Shared plumbing for the one-shot maintenance commands in this package"""
+import asyncio
+import logging
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+from database import mongo
+
+ROOT_DIR = Path(__file__).parent.parent
+
+
+def run_command(command):
+    """Run ``command(db)`` against the configured database and print its result"""
+    load_dotenv(ROOT_DIR / '.env')
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    async def main():
+        try:
+            return await command(mongo.connect())
+        finally:
+            mongo.close()
+
+    result = asyncio.run(main())
+    if result is not None:
+        print(result)
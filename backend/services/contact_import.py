@@ -0,0 +1,266 @@
+"""Contact imports from CSV files and vCards.
+
+Uploads are read row by row (Starlette has already spooled them to a
+temporary file) and written in chunks of ``IMPORT_CHUNK_SIZE`` as unordered
+upserts keyed on ``phone_normalized``, which has a unique index. Importing the
+same address book twice therefore updates contacts instead of duplicating
+them. ``python -m services.contact_import`` from ``backend/`` fills in
+``phone_normalized`` for contacts created before it existed.
+"""
+import codecs
+import csv
+import os
+import re
+import uuid
+from datetime import datetime
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from pydantic import ValidationError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from starlette.concurrency import run_in_threadpool
+
+from models.admin_models import ContactCreate
+
+IMPORT_CHUNK_SIZE = 1000
+MAX_REPORTED_REJECTIONS = 100
+
+# Accepted CSV headers (lower-cased) -> ContactCreate field
+CSV_COLUMNS = {
+    "name": "name",
+    "full name": "name",
+    "phone": "phone",
+    "phone number": "phone",
+    "mobile": "phone",
+    "email": "email",
+    "e-mail": "email",
+    "relationship": "relationship",
+    "notes": "notes",
+}
+
+_NON_DIGITS = re.compile(r"\D")
+
+
+def default_country_code() -> str:
+    return os.environ.get('DEFAULT_PHONE_COUNTRY_CODE', '91')
+
+
+def normalize_phone(phone: Optional[str], country_code: Optional[str] = None) -> Optional[str]:
+    """E.164-style ``+<digits>`` form of a phone number, or None if it is not one.
+
+    Numbers without an international prefix get ``DEFAULT_PHONE_COUNTRY_CODE``
+    (a leading trunk ``0`` is dropped first).
+    """
+    if not phone:
+        return None
+    phone = phone.strip()
+    international = phone.startswith("+") or phone.startswith("00")
+    digits = _NON_DIGITS.sub("", phone)
+    if phone.startswith("00"):
+        digits = digits[2:]
+    if not international:
+        country_code = country_code or default_country_code()
+        digits = digits.lstrip("0")
+        if not (digits.startswith(country_code) and len(digits) > 10):
+            digits = country_code + digits
+    if not 8 <= len(digits) <= 15:
+        return None
+    return "+" + digits
+
+
+def iter_csv_rows(lines: Iterable[str]) -> Iterator[dict]:
+    reader = csv.DictReader(lines)
+    for row in reader:
+        yield {
+            CSV_COLUMNS[header.strip().lower()]: (value or "").strip()
+            for header, value in row.items()
+            if header and header.strip().lower() in CSV_COLUMNS
+        }
+
+
+def _unfold(lines: Iterable[str]) -> Iterator[str]:
+    """Join vCard continuation lines (RFC 6350 folding)"""
+    current = None
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line[:1] in (" ", "\t") and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line
+    if current is not None:
+        yield current
+
+
+def iter_vcards(lines: Iterable[str]) -> Iterator[dict]:
+    card = None
+    for line in _unfold(lines):
+        name, _, value = line.partition(":")
+        prop, *params = name.split(";")
+        prop = prop.split(".")[-1].upper()
+        value = value.strip()
+        if prop == "BEGIN" and value.upper() == "VCARD":
+            card = {}
+        elif card is None:
+            continue
+        elif prop == "END":
+            card.pop("_cell", None)
+            yield card
+            card = None
+        elif prop == "FN":
+            card["name"] = value
+        elif prop == "N" and "name" not in card:
+            family, given = (value.split(";") + ["", ""])[:2]
+            card["name"] = " ".join(part for part in (given, family) if part)
+        elif prop == "TEL":
+            # Prefer a mobile number over whatever came first
+            is_cell = any("CELL" in param.upper() for param in params)
+            if "phone" not in card or (is_cell and not card.get("_cell")):
+                card["phone"] = value
+                card["_cell"] = is_cell
+        elif prop == "EMAIL" and "email" not in card:
+            card["email"] = value
+        elif prop == "NOTE":
+            card["notes"] = value.replace("\\n", "\n").replace("\\,", ",")
+
+
+def is_vcard(filename: Optional[str], content_type: Optional[str]) -> bool:
+    return (filename or "").lower().endswith((".vcf", ".vcard")) or (content_type or "").lower() in (
+        "text/vcard", "text/x-vcard", "text/directory"
+    )
+
+
+def contact_upsert(contact: ContactCreate, phone_normalized: str, now: datetime,
+                   keep_relationship: bool = False) -> UpdateOne:
+    """Upsert for one contact; ``keep_relationship`` leaves an existing contact's relationship alone"""
+    update = {"name": contact.name, "phone": contact.phone}
+    on_insert = {"id": str(uuid.uuid4()), "created_at": now, "phone_normalized": phone_normalized}
+    (on_insert if keep_relationship else update)["relationship"] = contact.relationship
+    if contact.email:
+        update["email"] = contact.email
+    if contact.notes:
+        update["notes"] = contact.notes
+    return UpdateOne({"phone_normalized": phone_normalized}, {"$set": update, "$setOnInsert": on_insert}, upsert=True)
+
+
+class ImportReport:
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.rejected = 0
+        self.rejections: List[dict] = []
+
+    def reject(self, row: int, reason):
+        self.rejected += 1
+        if len(self.rejections) < MAX_REPORTED_REJECTIONS:
+            self.rejections.append({"row": row, "reason": reason})
+
+    def as_dict(self) -> dict:
+        return {
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "rejected": self.rejected,
+            "rejections": self.rejections,
+        }
+
+
+async def _write_chunk(db, upserts: dict, report: ImportReport):
+    if not upserts:
+        return
+    try:
+        result = await db.contacts.bulk_write(list(upserts.values()), ordered=False)
+        report.inserted += result.upserted_count
+        report.updated += result.matched_count
+    except BulkWriteError as e:
+        # e.g. a concurrent import inserted the same phone first
+        report.inserted += e.details.get("nUpserted", 0)
+        report.updated += e.details.get("nMatched", 0)
+        for error in e.details.get("writeErrors", []):
+            report.reject(None, error.get("errmsg"))
+
+
+async def upsert_contacts(db, rows: Iterable[dict], default_relationship: str = "other") -> dict:
+    """Validate ``rows`` and upsert them chunk by chunk, keyed on the normalized phone"""
+    rows = iter(enumerate(rows, start=1))
+    report = ImportReport()
+    while True:
+        # Parsing is blocking file I/O, so pull each chunk off the event loop
+        chunk = await run_in_threadpool(lambda: list(islice(rows, IMPORT_CHUNK_SIZE)))
+        if not chunk:
+            break
+
+        now = datetime.utcnow()
+        rows_by_phone: Dict[str, dict] = {}
+        for number, row in chunk:
+            row = {key: value for key, value in row.items() if value}
+            try:
+                contact = ContactCreate(**{"relationship": default_relationship, **row})
+            except ValidationError as e:
+                report.reject(number, "; ".join(
+                    f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors()
+                ))
+                continue
+            phone_normalized = normalize_phone(contact.phone)
+            if not phone_normalized:
+                report.reject(number, f"Invalid phone number: {contact.phone}")
+                continue
+            if phone_normalized in rows_by_phone:
+                # Same phone earlier in the chunk: an update of that contact,
+                # with this row's non-empty fields winning
+                rows_by_phone[phone_normalized].update(row)
+                report.updated += 1
+            else:
+                rows_by_phone[phone_normalized] = row
+
+        upserts = {
+            phone_normalized: contact_upsert(
+                ContactCreate(**{"relationship": default_relationship, **row}), phone_normalized, now,
+                keep_relationship="relationship" not in row
+            )
+            for phone_normalized, row in rows_by_phone.items()
+        }
+        await _write_chunk(db, upserts, report)
+    return report.as_dict()
+
+
+async def import_contacts_file(db, file, default_relationship: str = "other") -> dict:
+    """Import an uploaded CSV or vCard file"""
+    await file.seek(0)
+    lines = codecs.iterdecode(file.file, "utf-8-sig", errors="replace")
+    rows = iter_vcards(lines) if is_vcard(file.filename, file.content_type) else iter_csv_rows(lines)
+    return await upsert_contacts(db, rows, default_relationship)
+
+
+async def backfill_normalized_phones(db) -> dict:
+    """Set ``phone_normalized`` on contacts that predate it"""
+    counts = {"normalized": 0, "duplicates": 0, "invalid": 0}
+
+    async def flush(updates):
+        try:
+            result = await db.contacts.bulk_write(updates, ordered=False)
+            counts["normalized"] += result.modified_count
+        except BulkWriteError as e:
+            # Later contacts sharing a phone are left for manual merging
+            counts["normalized"] += e.details.get("nModified", 0)
+            counts["duplicates"] += len(e.details.get("writeErrors", []))
+
+    updates = []
+    async for contact in db.contacts.find({"phone_normalized": {"$exists": False}}, {"phone": 1}):
+        phone_normalized = normalize_phone(contact.get("phone"))
+        if not phone_normalized:
+            counts["invalid"] += 1
+            continue
+        updates.append(UpdateOne({"_id": contact["_id"]}, {"$set": {"phone_normalized": phone_normalized}}))
+        if len(updates) >= IMPORT_CHUNK_SIZE:
+            await flush(updates)
+            updates = []
+    if updates:
+        await flush(updates)
+    return counts
+
+
+if __name__ == "__main__":
+    from services.cli import run_command
+    run_command(backfill_normalized_phones)
@@ -0,0 +1,144 @@
+import asyncio
+import logging
+from typing import Dict, List
+
+from fastapi import Request
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+# Visitor session counters bumped by each event type
+SESSION_COUNTERS = {
+    "page_view": "total_page_views",
+    "cart_add": "items_added_to_cart",
+    "checkout_start": "checkout_attempts",
+    "order_complete": "orders_placed",
+}
+
+_STOP = object()
+
+
+def build_session_updates(events: List[dict]) -> List[UpdateOne]:
+    """Coalesce the session counter updates for a batch of visitor events"""
+    updates: Dict[str, dict] = {}
+    for event in events:
+        counter = SESSION_COUNTERS.get(event["event_type"])
+        if not counter:
+            continue
+
+        update = updates.setdefault(event["session_id"], {"$inc": {}, "$max": {}, "$set": {}})
+        update["$inc"][counter] = update["$inc"].get(counter, 0) + 1
+
+        # $max, because buffered and batched events can be older than a
+        # heartbeat that has already moved last_activity on
+        last_activity = update["$max"].get("last_activity")
+        if last_activity is None or event["timestamp"] > last_activity:
+            update["$max"]["last_activity"] = event["timestamp"]
+
+        if event["event_type"] == "order_complete":
+            update["$inc"]["total_order_value"] = (
+                update["$inc"].get("total_order_value", 0) + (event.get("cart_value") or 0)
+            )
+            update["$set"]["converted_to_customer"] = True
+
+    return [
+        UpdateOne({"session_id": session_id}, {operator: fields for operator, fields in update.items() if fields})
+        for session_id, update in updates.items()
+    ]
+
+
+class VisitorEventBuffer:
+    """Write-behind buffer that batches visitor events into MongoDB.
+
+    Events are acknowledged as soon as they are queued and flushed once
+    ``max_batch_size`` events are pending or ``flush_interval`` seconds have
+    passed since the first pending event, whichever comes first.
+    """
+
+    def __init__(self, db, max_batch_size: int = 500, flush_interval: float = 1.0, max_pending: int = 10000):
+        self.db = db
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._queue = None
+        self._task = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    async def start(self):
+        """Start the background flush task"""
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.max_pending)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush everything still queued and stop the background task"""
+        if self._task is None:
+            return
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+        self._queue = None
+
+    async def put(self, event: dict):
+        """Queue an event; waits only when ``max_pending`` events are already queued"""
+        if self._task is None:
+            # Not started (scripts, one-off tools): write straight through
+            await self.write_batch([event])
+            return
+        await self._queue.put(event)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            if item is _STOP:
+                return
+
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            stopping = False
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self.write_batch(batch)
+            if stopping:
+                return
+
+    async def write_batch(self, events: List[dict]):
+        """Persist a batch of events and their coalesced session updates"""
+        if not events:
+            return
+        try:
+            await self.db.visitor_events.insert_many(events, ordered=False)
+        except BulkWriteError as e:
+            logger.error("Failed to insert %d of %d visitor events: %s",
+                         len(e.details.get("writeErrors", [])), len(events), e.details.get("writeErrors"))
+        except Exception:
+            logger.exception("Failed to insert %d visitor events", len(events))
+
+        session_updates = build_session_updates(events)
+        if not session_updates:
+            return
+        try:
+            await self.db.visitor_sessions.bulk_write(session_updates, ordered=False)
+        except Exception:
+            logger.exception("Failed to apply %d visitor session updates", len(session_updates))
+
+
+def get_visitor_event_buffer(request: Request) -> VisitorEventBuffer:
+    """FastAPI dependency returning the app's visitor event buffer"""
+    return request.app.state.visitor_event_buffer
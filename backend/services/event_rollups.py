@@ -0,0 +1,250 @@
+"""Retention for raw tracking events and their long-term rollups.
+
+Raw ``visitor_events`` and ``link_tracking`` documents can expire after
+``RAW_EVENT_RETENTION_DAYS`` (a TTL index on ``timestamp``, or the collection's
+``expireAfterSeconds`` for the time-series layout). The default of 0 keeps
+them forever. Before they go, ``EventRollupJob`` folds them into two
+collections that are kept indefinitely:
+
+* ``event_rollups_hourly``, recomputed from the raw events of recent hours;
+* ``event_rollups_daily``, recomputed from the hourly rollups.
+
+Each rollup document counts the events (and sums ``cart_value``) of one
+bucket per source collection, event type, product and link. Rollups are
+written with ``$merge``, so recomputing a bucket is idempotent. Raw events are
+never updated or deleted except by expiry, so a recomputed bucket only
+replaces a stored one with a count at least as high; buckets whose raw events
+have partly expired keep their rollups.
+
+The job records how far the rollups are complete in ``event_rollup_state``
+and resumes from there, so a fresh deployment first rolls up every stored
+event. Expiry is only switched on after such a run has succeeded. Run
+``python -m services.event_rollups`` from ``backend/`` to backfill them
+from every raw event still stored.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+from pymongo import DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from services.indexes import create_index
+from services.timeseries import TIMESERIES_COLLECTIONS, collection_types
+
+logger = logging.getLogger(__name__)
+
+# Raw collection -> link field grouped on (visitor events have none)
+ROLLUP_SOURCES = {
+    "visitor_events": None,
+    "link_tracking": "$link_id",
+}
+HOURLY = "event_rollups_hourly"
+DAILY = "event_rollups_daily"
+STATE = "event_rollup_state"
+COVERAGE_ID = "raw_events"
+# Events reach MongoDB after they happened (write-behind buffer, batched
+# beacons), so each run recomputes this much before its previous run
+LATE_EVENT_ALLOWANCE = timedelta(hours=1)
+
+
+def retention_days() -> float:
+    return float(os.environ.get('RAW_EVENT_RETENTION_DAYS', 0))
+
+
+def retention_period() -> Optional[timedelta]:
+    days = retention_days()
+    return timedelta(days=days) if days else None
+
+
+def floor_hour(moment: datetime) -> datetime:
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def floor_day(moment: datetime) -> datetime:
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+async def _drop_ttl_index(collection):
+    # A TTL cannot be removed in place; dropping the index loses no data
+    for name, info in (await collection.index_information()).items():
+        if "expireAfterSeconds" in info and [tuple(key) for key in info["key"]] == [("timestamp", DESCENDING)]:
+            await collection.drop_index(name)
+
+
+async def apply_retention(db, days: float):
+    """Create, update or remove the expiry of every raw event collection"""
+    seconds = int(days * 86400) if days else None
+    types = await collection_types(db)
+    for collection in TIMESERIES_COLLECTIONS:
+        try:
+            if types.get(collection) == "timeseries":
+                # Time-series collections expire whole buckets by collection option
+                await db.command({"collMod": collection, "expireAfterSeconds": seconds or "off"})
+                await create_index(db[collection], IndexModel([("timestamp", DESCENDING)]))
+            else:
+                options = {"expireAfterSeconds": seconds} if seconds else {}
+                if not seconds:
+                    await _drop_ttl_index(db[collection])
+                await create_index(db[collection], IndexModel([("timestamp", DESCENDING)], **options))
+        except OperationFailure as e:
+            logger.error("Could not apply retention to %s: %s", collection, e)
+
+
+def _rollup_stages(group_id: dict, count, value, refreshed_at: datetime, into: str) -> list:
+    return [
+        {"$group": {"_id": group_id, "count": {"$sum": count}, "value": {"$sum": value}}},
+        {
+            "$project": {
+                "bucket": "$_id.bucket",
+                "source": "$_id.source",
+                "event_type": "$_id.event_type",
+                "product_id": "$_id.product_id",
+                "link_id": "$_id.link_id",
+                "count": 1,
+                "value": 1,
+                "refreshed_at": {"$literal": refreshed_at}
+            }
+        },
+        {"$merge": {
+            "into": into,
+            "on": "_id",
+            "whenMatched": [
+                {"$replaceWith": {"$cond": [{"$gt": ["$count", "$$new.count"]}, "$$ROOT", "$$new"]}}
+            ],
+            "whenNotMatched": "insert"
+        }}
+    ]
+
+
+def hourly_pipeline(source: str, since: Optional[datetime], refreshed_at: datetime) -> list:
+    """Rollup of one raw collection into hourly buckets from ``since`` on"""
+    link_field = ROLLUP_SOURCES[source]
+    group_id = {
+        "bucket": {"$dateTrunc": {"date": "$timestamp", "unit": "hour"}},
+        "source": {"$literal": source},
+        "event_type": "$event_type",
+        "product_id": {"$ifNull": ["$product_id", None]},
+        "link_id": {"$ifNull": [link_field, None]} if link_field else {"$literal": None},
+    }
+    match = {"timestamp": {"$gte": since}} if since else {"timestamp": {"$type": "date"}}
+    return [{"$match": match}] + _rollup_stages(
+        group_id, 1, {"$ifNull": ["$cart_value", 0]}, refreshed_at, HOURLY
+    )
+
+
+def daily_pipeline(since: Optional[datetime], refreshed_at: datetime) -> list:
+    """Rollup of the hourly buckets into daily buckets from ``since`` on"""
+    group_id = {
+        "bucket": {"$dateTrunc": {"date": "$bucket", "unit": "day"}},
+        "source": "$source",
+        "event_type": "$event_type",
+        "product_id": "$product_id",
+        "link_id": "$link_id",
+    }
+    stages = [{"$match": {"bucket": {"$gte": since}}}] if since else []
+    return stages + _rollup_stages(group_id, "$count", "$value", refreshed_at, DAILY)
+
+
+async def rollup_coverage(db) -> Optional[datetime]:
+    """Time up to which every raw event has been rolled up, if recorded"""
+    state = await db[STATE].find_one({"_id": COVERAGE_ID})
+    return state["covered_until"] if state else None
+
+
+async def record_coverage(db, until: datetime):
+    await db[STATE].update_one({"_id": COVERAGE_ID}, {"$max": {"covered_until": until}}, upsert=True)
+
+
+async def refresh_event_rollups(db, since: Optional[datetime], retention: Optional[timedelta] = None):
+    """Recompute the hourly buckets from ``since`` and the days they fall in"""
+    refreshed_at = datetime.utcnow()
+    if since is not None:
+        since = floor_hour(since)
+    if retention is not None:
+        # Never recompute an hour whose raw events have started to expire
+        oldest_complete = floor_hour(refreshed_at - retention) + timedelta(hours=1)
+        if since is not None and since < oldest_complete:
+            logger.warning("Raw events between %s and %s expired before they were rolled up",
+                           since, oldest_complete)
+        since = max(since, oldest_complete) if since else oldest_complete
+
+    for source in ROLLUP_SOURCES:
+        await db[source].aggregate(hourly_pipeline(source, since, refreshed_at), allowDiskUse=True).to_list(None)
+    await db[HOURLY].aggregate(
+        daily_pipeline(floor_day(since) if since else None, refreshed_at), allowDiskUse=True
+    ).to_list(None)
+
+
+class EventRollupJob:
+    """Background job rolling recent raw events into the hourly and daily rollups"""
+
+    def __init__(self, db, interval: float = 900.0, retention: Optional[timedelta] = None):
+        self.db = db
+        self.interval = interval
+        self.retention = retention
+        # Loaded from event_rollup_state by the first run
+        self._watermark: Optional[datetime] = None
+        self._retention_applied = False
+        self._task = None
+
+    async def start(self):
+        if self.retention is None:
+            # Turning expiry off loses nothing, so it need not wait for a rollup
+            await apply_retention(self.db, 0)
+            self._retention_applied = True
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def refresh(self):
+        started = datetime.utcnow()
+        if self._watermark is None:
+            # Resume where the rollups are complete; with no record, roll up everything
+            self._watermark = await rollup_coverage(self.db)
+        since = self._watermark - LATE_EVENT_ALLOWANCE if self._watermark else None
+        # Without recorded coverage expiry has never been on, so every stored
+        # event is still there and must be rolled up before it can be
+        in_effect = self._retention_applied or self._watermark is not None
+        await refresh_event_rollups(self.db, since, self.retention if in_effect else None)
+        await record_coverage(self.db, started)
+        self._watermark = started
+
+        if not self._retention_applied:
+            # Every stored event is now rolled up, so raw events may start expiring
+            await apply_retention(self.db, self.retention.total_seconds() / 86400)
+            self._retention_applied = True
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Event rollup refresh failed")
+            await asyncio.sleep(self.interval)
+
+
+async def rebuild_event_rollups(db) -> dict:
+    started = datetime.utcnow()
+    # Hours whose raw events partly expired keep their larger stored rollups
+    await refresh_event_rollups(db, since=None)
+    await record_coverage(db, started)
+    return {
+        HOURLY: await db[HOURLY].count_documents({}),
+        DAILY: await db[DAILY].count_documents({}),
+    }
+
+
+if __name__ == "__main__":
+    from services.cli import run_command
+    run_command(rebuild_event_rollups)
@@ -0,0 +1,179 @@
+"""Product image upload pipeline.
+
+Uploads are streamed to disk in chunks off the event loop, capped at
+``IMAGE_MAX_UPLOAD_BYTES`` and stored under the SHA-256 of their content, so
+the same photo uploaded twice is stored once. Resized WebP variants are
+generated in a process pool and written next to the original as
+``<digest>_<width>.webp``. Partial files live in ``UPLOAD_TMP_DIR``, which
+is not served, until they are complete.
+"""
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request, Response, UploadFile
+from fastapi.routing import APIRoute
+from starlette.concurrency import run_in_threadpool
+from starlette.staticfiles import StaticFiles
+
+UPLOAD_DIR = Path("/app/uploads")
+# Same filesystem as UPLOAD_DIR so finished files can be moved in atomically
+UPLOAD_TMP_DIR = Path("/app/upload_tmp")
+CHUNK_SIZE = 1024 * 1024
+VARIANT_WIDTHS = (320, 640, 1280)
+# Allowance for multipart boundaries and part headers around the file
+MULTIPART_OVERHEAD = 64 * 1024
+
+# Pillow format name -> stored file extension
+FORMAT_EXTENSIONS = {
+    "JPEG": ".jpg",
+    "PNG": ".png",
+    "WEBP": ".webp",
+    "GIF": ".gif",
+}
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def max_upload_bytes() -> int:
+    return int(os.environ.get('IMAGE_MAX_UPLOAD_BYTES', 10 * 1024 * 1024))
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # Forking a process that already runs Motor's threads can deadlock
+        _executor = ProcessPoolExecutor(
+            max_workers=int(os.environ.get('IMAGE_WORKERS', 2)),
+            mp_context=multiprocessing.get_context("forkserver")
+        )
+    return _executor
+
+
+def shutdown_image_workers():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+def _identify(path: str) -> Tuple[str, int]:
+    """Return the Pillow format and width of an image, raising if it is not one"""
+    from PIL import Image
+
+    with Image.open(path) as image:
+        image.verify()
+    with Image.open(path) as image:
+        return image.format, image.width
+
+
+def _generate_variants(source: str, digest: str, widths: Tuple[int, ...]) -> Dict[int, str]:
+    """Write WebP variants narrower than the source; runs in the worker pool"""
+    from PIL import Image, ImageOps
+
+    variants = {}
+    with Image.open(source) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        for width in widths:
+            if width >= image.width:
+                continue
+            filename = f"{digest}_{width}.webp"
+            target = UPLOAD_DIR / filename
+            if not target.exists():
+                height = round(image.height * width / image.width)
+                resized = image.resize((width, height), Image.LANCZOS)
+                tmp = UPLOAD_TMP_DIR / f"{filename}.{os.getpid()}.tmp"
+                resized.save(tmp, "WEBP", quality=80, method=4)
+                os.replace(tmp, target)
+            variants[width] = filename
+    return variants
+
+
+async def _stream_to_temp(file: UploadFile) -> Tuple[str, str]:
+    """Copy the upload to a temp file in chunks, returning (path, sha256)"""
+    limit = max_upload_bytes()
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_TMP_DIR, suffix=".upload")
+    try:
+        with os.fdopen(fd, "wb") as buffer:
+            while True:
+                chunk = await file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > limit:
+                    raise HTTPException(status_code=413, detail=f"Image exceeds the {limit} byte upload limit")
+                digest.update(chunk)
+                await run_in_threadpool(buffer.write, chunk)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return tmp_path, digest.hexdigest()
+
+
+async def save_image(file: UploadFile) -> dict:
+    """Store an uploaded image once per content hash and build its variants"""
+    UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    UPLOAD_TMP_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path, digest = await _stream_to_temp(file)
+    digest = digest[:32]
+
+    try:
+        image_format, width = await run_in_threadpool(_identify, tmp_path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise HTTPException(status_code=400, detail="File must be a valid image")
+
+    extension = FORMAT_EXTENSIONS.get(image_format)
+    if not extension:
+        os.unlink(tmp_path)
+        raise HTTPException(status_code=400, detail=f"Unsupported image format: {image_format}")
+
+    filename = f"{digest}{extension}"
+    target = UPLOAD_DIR / filename
+    if target.exists():
+        os.unlink(tmp_path)
+    else:
+        os.replace(tmp_path, target)
+
+    loop = asyncio.get_running_loop()
+    variants = await loop.run_in_executor(_get_executor(), _generate_variants, str(target), digest, VARIANT_WIDTHS)
+
+    return {
+        "image_url": f"/uploads/{filename}",
+        "width": width,
+        "variants": {str(w): f"/uploads/{name}" for w, name in sorted(variants.items())},
+    }
+
+
+class UploadLimitRoute(APIRoute):
+    """Rejects bodies whose Content-Length is over the upload limit before they are spooled"""
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def limited_handler(request: Request) -> Response:
+            limit = max_upload_bytes()
+            content_length = request.headers.get("content-length")
+            if content_length and content_length.isdigit() and int(content_length) > limit + MULTIPART_OVERHEAD:
+                raise HTTPException(status_code=413, detail=f"Image exceeds the {limit} byte upload limit")
+            return await handler(request)
+
+        return limited_handler
+
+
+class UploadStaticFiles(StaticFiles):
+    """Static files for /uploads; stored names never change content, so cache them for good"""
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
@@ -0,0 +1,223 @@
+"""Declarative index registry for every collection the routers query.
+
+``apply_indexes`` runs at startup. ``create_indexes`` is a no-op for indexes
+that already exist, so applying the registry repeatedly is safe. An index
+whose options changed in the registry is altered in place with ``collMod``
+where MongoDB allows it (TTL, hidden, becoming unique); otherwise the new
+index is built alongside it as ``<name>_rebuild`` and the old one is only
+dropped once that build has succeeded.
+"""
+import logging
+from typing import Dict, List, Optional
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+INDEX_OPTIONS_CONFLICT = 85
+INDEX_KEY_SPECS_CONFLICT = 86
+INDEX_NOT_FOUND = 27
+
+# Commands that remove the duplicates blocking a registry unique index
+DEDUPLICATE_COMMANDS = {
+    "visitor_sessions": "python -m services.visitor_sessions",
+}
+
+# Options that make two indexes on the same keys different
+_COMPARED_OPTIONS = ("unique", "sparse", "expireAfterSeconds", "partialFilterExpression", "collation", "hidden")
+
+
+def _unique(field: str) -> IndexModel:
+    return IndexModel([(field, ASCENDING)], unique=True)
+
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "products": [
+        _unique("id"),
+        IndexModel([("category", ASCENDING), ("status", ASCENDING)]),
+    ],
+    "orders": [
+        _unique("id"),
+        # Keyset pagination on (created_at, id), optionally behind a filter
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("status", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("delivery_status", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("customer_phone", ASCENDING), ("created_at", DESCENDING)]),
+        # Daily revenue refresh looks for recently changed orders
+        IndexModel([("updated_at", DESCENDING)]),
+    ],
+    "daily_revenue": [
+        IndexModel([("date", ASCENDING), ("delivery_status", ASCENDING)], unique=True),
+    ],
+    "contacts": [
+        _unique("id"),
+        IndexModel([("phone", ASCENDING)]),
+        # Imports upsert on the normalized phone; contacts without one are not deduplicated
+        IndexModel(
+            [("phone_normalized", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"phone_normalized": {"$type": "string"}}
+        ),
+    ],
+    "personalized_links": [
+        _unique("id"),
+        _unique("link_token"),
+        IndexModel([("contact_id", ASCENDING)]),
+        IndexModel([("created_at", DESCENDING)]),
+    ],
+    "campaigns": [
+        _unique("id"),
+    ],
+    # The timestamp (retention) indexes of the raw event collections are
+    # managed by services.event_rollups.apply_retention
+    "link_tracking": [
+        IndexModel([("link_id", ASCENDING), ("timestamp", DESCENDING)]),
+    ],
+    "link_stats": [
+        _unique("link_id"),
+    ],
+    "visitor_sessions": [
+        _unique("session_id"),
+        IndexModel([("first_visit", DESCENDING)]),
+    ],
+    "visitor_events": [
+        IndexModel([("session_id", ASCENDING), ("timestamp", DESCENDING)]),
+    ],
+    "event_rollups_hourly": [
+        IndexModel([("bucket", DESCENDING)]),
+    ],
+    "event_rollups_daily": [
+        IndexModel([("bucket", DESCENDING)]),
+    ],
+    "cart_abandonments": [
+        IndexModel([("recovered", ASCENDING), ("abandoned_at", DESCENDING)]),
+        IndexModel([("abandoned_at", DESCENDING)]),
+    ],
+    "review_requests": [
+        _unique("id"),
+        # One review request per order, enforced even under concurrent sends
+        _unique("order_id"),
+        IndexModel([("status", ASCENDING), ("request_sent_date", DESCENDING)]),
+        IndexModel([("request_sent_date", DESCENDING)]),
+    ],
+    "customer_reviews": [
+        _unique("id"),
+        IndexModel([("order_id", ASCENDING)]),
+        IndexModel([("review_date", DESCENDING)]),
+    ],
+}
+
+
+async def apply_indexes(db) -> Dict[str, List[str]]:
+    """Create any missing registry indexes; failures are logged, not raised"""
+    created = {}
+    for collection, indexes in INDEXES.items():
+        created[collection] = []
+        for index in indexes:
+            try:
+                created[collection] += await create_index(db[collection], index)
+            except OperationFailure as e:
+                if index.document.get("unique"):
+                    # Usually duplicate keys left from before the index existed
+                    command = DEDUPLICATE_COMMANDS.get(collection)
+                    logger.error(
+                        "Could not create unique index %s on %s, so uniqueness is NOT enforced: %s%s",
+                        index.document["name"], collection, e,
+                        f" (remove duplicates with `{command}`)" if command else ""
+                    )
+                else:
+                    logger.error("Could not create index %s on %s: %s",
+                                 index.document["name"], collection, e)
+    return created
+
+
+def _options(spec: dict) -> dict:
+    return {option: spec[option] for option in _COMPARED_OPTIONS
+            if option in spec and spec[option] is not False}
+
+
+def _keys(spec: dict) -> list:
+    return [tuple(key) for key in (spec["key"].items() if isinstance(spec["key"], dict) else spec["key"])]
+
+
+async def _modify_index(collection, name: str, current: dict, wanted: dict) -> bool:
+    """Apply option changes with ``collMod``; False if they cannot be made in place"""
+    changed = {option for option in set(current) | set(wanted) if current.get(option) != wanted.get(option)}
+    if not changed <= {"expireAfterSeconds", "hidden", "unique"}:
+        return False
+    if "expireAfterSeconds" in changed and "expireAfterSeconds" not in wanted:
+        return False
+    if "unique" in changed and not wanted.get("unique"):
+        return False
+
+    async def coll_mod(**options):
+        await collection.database.command("collMod", collection.name, index={"name": name, **options})
+
+    if "expireAfterSeconds" in changed:
+        await coll_mod(expireAfterSeconds=wanted["expireAfterSeconds"])
+    if "hidden" in changed:
+        await coll_mod(hidden=bool(wanted.get("hidden")))
+    if "unique" in changed:
+        # prepareUnique blocks new duplicates; the conversion fails if old ones exist
+        await coll_mod(prepareUnique=True)
+        try:
+            await coll_mod(unique=True)
+        except OperationFailure:
+            await coll_mod(prepareUnique=False)
+            raise
+    return True
+
+
+async def create_index(collection, index: IndexModel) -> List[str]:
+    """Create one index, altering or replacing it if it exists with different options"""
+    try:
+        return await collection.create_indexes([index])
+    except OperationFailure as e:
+        if e.code not in (INDEX_OPTIONS_CONFLICT, INDEX_KEY_SPECS_CONFLICT):
+            raise
+
+    spec = index.document
+    name, keys, wanted = spec["name"], _keys(spec), _options(spec)
+    existing = await collection.index_information()
+    # Already in place under another name, e.g. left by an earlier rebuild
+    if any(_keys(info) == keys and _options(info) == wanted for info in existing.values()):
+        return []
+
+    current_name: Optional[str] = name if name in existing else next(
+        (other for other, info in existing.items() if _keys(info) == keys), None
+    )
+    if current_name and _keys(existing[current_name]) == keys:
+        if await _modify_index(collection, current_name, _options(existing[current_name]), wanted):
+            logger.warning("Modified index %s on %s in place", current_name, collection.name)
+            return [current_name]
+
+    # Build the replacement first; if that fails the old index is left alone
+    logger.warning("Rebuilding index %s on %s with new options", name, collection.name)
+    options = {option: value for option, value in spec.items() if option not in ("key", "name")}
+    created = await collection.create_indexes([IndexModel(keys, name=f"{name}_rebuild", **options)])
+    if current_name:
+        try:
+            await collection.drop_index(current_name)
+        except OperationFailure as e:
+            # Another worker dropped it first
+            if e.code != INDEX_NOT_FOUND:
+                raise
+    return created
+
+
+async def get_index_stats(db) -> Dict[str, List[dict]]:
+    """Per-index usage counters from ``$indexStats`` for every registry collection"""
+    stats = {}
+    for collection in INDEXES:
+        entries = await db[collection].aggregate([{"$indexStats": {}}]).to_list(None)
+        stats[collection] = [
+            {
+                "name": entry["name"],
+                "key": dict(entry["key"]),
+                "ops": entry["accesses"]["ops"],
+                "since": entry["accesses"]["since"],
+            }
+            for entry in sorted(entries, key=lambda e: e["accesses"]["ops"], reverse=True)
+        ]
+    return stats
@@ -0,0 +1,115 @@
+"""Per-link analytics rollups kept in the ``link_stats`` collection.
+
+``track_event`` folds every tracking event into its link's rollup document
+so the link analytics page never has to scan ``link_tracking``. Run
+``python -m services.link_stats`` from ``backend/`` to rebuild the rollups
+from existing ``link_tracking`` data. Raw events may already have expired
+(``RAW_EVENT_RETENTION_DAYS``), so a rebuild only ever raises counters and
+adds to the viewed sets of an existing rollup, never lowers them.
+"""
+
+# Tracking event types that feed a counter on the rollup document
+EVENT_COUNTERS = {
+    "link_opened": "total_opens",
+    "item_added": "items_added_to_cart",
+    "checkout_started": "checkouts_started",
+    "order_placed": "orders_placed",
+}
+
+
+def build_link_stats_update(event: dict) -> dict:
+    """Build the upsert that folds one ``link_tracking`` event into its rollup"""
+    update = {
+        "$setOnInsert": {"contact_id": event["contact_id"]},
+        "$inc": {"total_events": 1},
+        "$max": {"last_event": event["timestamp"]},
+    }
+
+    counter = EVENT_COUNTERS.get(event["event_type"])
+    if counter:
+        update["$inc"][counter] = 1
+    if event["event_type"] == "link_opened":
+        update["$max"]["last_opened"] = event["timestamp"]
+
+    add_to_set = {}
+    if event["event_type"] == "page_viewed" and event.get("page_url"):
+        add_to_set["pages_viewed"] = event["page_url"]
+    if event.get("product_id"):
+        add_to_set["products_viewed"] = event["product_id"]
+    if add_to_set:
+        update["$addToSet"] = add_to_set
+
+    return update
+
+
+async def record_link_event(db, event: dict):
+    """Apply one tracking event to the ``link_stats`` rollup"""
+    await db.link_stats.update_one(
+        {"link_id": event["link_id"]},
+        build_link_stats_update(event),
+        upsert=True
+    )
+
+
+def _count_of(event_type: str) -> dict:
+    return {"$sum": {"$cond": [{"$eq": ["$event_type", event_type]}, 1, 0]}}
+
+
+def rebuild_pipeline() -> list:
+    """Aggregation that recomputes rollups from ``link_tracking`` and merges them into ``link_stats``"""
+    group = {
+        "_id": "$link_id",
+        "contact_id": {"$first": "$contact_id"},
+        "total_events": {"$sum": 1},
+        "last_event": {"$max": "$timestamp"},
+        "last_opened": {
+            "$max": {"$cond": [{"$eq": ["$event_type", "link_opened"]}, "$timestamp", None]}
+        },
+        "pages_viewed": {
+            "$addToSet": {
+                "$cond": [{"$eq": ["$event_type", "page_viewed"]}, {"$ifNull": ["$page_url", None]}, None]
+            }
+        },
+        "products_viewed": {"$addToSet": {"$ifNull": ["$product_id", None]}},
+    }
+    for event_type, counter in EVENT_COUNTERS.items():
+        group[counter] = _count_of(event_type)
+
+    # Existing rollups keep whatever expired events contributed
+    merged = {
+        field: {"$max": [f"${field}", f"$$new.{field}"]}
+        for field in ["total_events", "last_event", "last_opened", *EVENT_COUNTERS.values()]
+    }
+    merged.update({
+        field: {"$setUnion": [{"$ifNull": [f"${field}", []]}, f"$$new.{field}"]}
+        for field in ("pages_viewed", "products_viewed")
+    })
+    merged["contact_id"] = {"$ifNull": ["$contact_id", "$$new.contact_id"]}
+
+    return [
+        {"$group": group},
+        {"$set": {
+            "link_id": "$_id",
+            "pages_viewed": {"$setDifference": ["$pages_viewed", [None, ""]]},
+            "products_viewed": {"$setDifference": ["$products_viewed", [None, ""]]},
+        }},
+        {"$unset": "_id"},
+        {"$merge": {
+            "into": "link_stats",
+            "on": "link_id",
+            "whenMatched": [{"$set": merged}],
+            "whenNotMatched": "insert"
+        }},
+    ]
+
+
+async def rebuild_link_stats(db) -> dict:
+    """Rebuild every ``link_stats`` rollup from the raw ``link_tracking`` events"""
+    await db.link_stats.create_index("link_id", unique=True)
+    await db.link_tracking.aggregate(rebuild_pipeline(), allowDiskUse=True).to_list(None)
+    return {"links_rebuilt": await db.link_stats.count_documents({})}
+
+
+if __name__ == "__main__":
+    from services.cli import run_command
+    run_command(rebuild_link_stats)
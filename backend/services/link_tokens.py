@@ -0,0 +1,56 @@
+"""Cached ``link_token`` -> personalized link resolution for tracking calls.
+
+Tokens are immutable, so resolved links are cached per worker. Unknown and
+inactive tokens are cached too (for a shorter time) so floods of bogus tokens
+do not reach MongoDB. Deactivating a link drops its token from this worker's
+cache; other workers see the change once their entry expires.
+"""
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+from services.ttl_cache import TTLCache
+
+_MISSING = object()
+
+
+class ResolvedLink(NamedTuple):
+    link_id: str
+    contact_id: str
+    expires_at: Optional[datetime]
+    is_active: bool
+
+    @property
+    def is_usable(self) -> bool:
+        return self.is_active and (self.expires_at is None or self.expires_at > datetime.utcnow())
+
+
+class LinkTokenCache:
+    def __init__(self, ttl: float = 60.0, negative_ttl: float = 30.0, maxsize: int = 10000):
+        self.negative_ttl = negative_ttl
+        self._cache = TTLCache(ttl=ttl, maxsize=maxsize)
+
+    def configure(self, ttl: float, negative_ttl: float, maxsize: int):
+        self.negative_ttl = negative_ttl
+        self._cache = TTLCache(ttl=ttl, maxsize=maxsize)
+
+    async def resolve(self, db, link_token: str) -> Optional[ResolvedLink]:
+        """The usable link for ``link_token``, or None if unknown, inactive or expired"""
+        link = self._cache.get(link_token, _MISSING)
+        if link is _MISSING:
+            doc = await db.personalized_links.find_one(
+                {"link_token": link_token},
+                {"_id": 0, "id": 1, "contact_id": 1, "expires_at": 1, "is_active": 1}
+            )
+            if doc:
+                link = ResolvedLink(doc["id"], doc["contact_id"], doc.get("expires_at"), doc.get("is_active", False))
+                self._cache.set(link_token, link, ttl=None if link.is_active else self.negative_ttl)
+            else:
+                link = None
+                self._cache.set(link_token, None, ttl=self.negative_ttl)
+        return link if link is not None and link.is_usable else None
+
+    def invalidate(self, link_token: str):
+        self._cache.invalidate(link_token)
+
+
+link_token_cache = LinkTokenCache()
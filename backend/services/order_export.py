@@ -0,0 +1,84 @@
+"""Streaming order exports for ``GET /admin/orders/export``.
+
+Orders are read from a Motor cursor in batches of ``EXPORT_BATCH_SIZE`` and
+written out as they arrive, so memory stays flat whatever the export size.
+CSV has one row per order item with the order columns repeated; NDJSON has
+one order per line with its items nested.
+"""
+import csv
+import io
+import json
+from datetime import datetime
+from typing import AsyncIterator
+
+EXPORT_BATCH_SIZE = 500
+
+ORDER_COLUMNS = [
+    "id", "created_at", "updated_at", "status", "delivery_status", "payment_status",
+    "customer_name", "customer_phone", "customer_email", "customer_address", "customer_type",
+    "total_amount", "delivery_cost", "final_amount",
+    "delivery_date", "dispatched_date", "delivered_date", "notes", "admin_notes",
+]
+ITEM_COLUMNS = ["product_id", "product_name", "price", "quantity", "unit"]
+CSV_HEADER = ORDER_COLUMNS + [f"item_{column}" for column in ITEM_COLUMNS]
+
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def _final_amount(order: dict) -> float:
+    final_amount = order.get("final_amount")
+    if final_amount is None:
+        final_amount = (order.get("total_amount") or 0) + (order.get("delivery_cost") or 0)
+    return final_amount
+
+
+def _csv_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return "" if value is None else value
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+async def iter_csv(cursor) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_HEADER)
+    rows = 0
+    async for order in cursor:
+        order["final_amount"] = _final_amount(order)
+        row = [_csv_value(order.get(column)) for column in ORDER_COLUMNS]
+        for item in order.get("items") or [{}]:
+            writer.writerow(row + [_csv_value(item.get(column)) for column in ITEM_COLUMNS])
+        rows += 1
+        # Hand over one chunk per cursor batch
+        if rows % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+async def iter_ndjson(cursor) -> AsyncIterator[str]:
+    lines = []
+    async for order in cursor:
+        order["final_amount"] = _final_amount(order)
+        lines.append(json.dumps(order, default=_json_default, separators=(",", ":")))
+        if len(lines) >= EXPORT_BATCH_SIZE:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+EXPORT_WRITERS = {
+    "csv": iter_csv,
+    "ndjson": iter_ndjson,
+}
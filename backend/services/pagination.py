@@ -0,0 +1,36 @@
+"""Keyset pagination over ``(created_at, id)`` with opaque cursors"""
+import base64
+import json
+from datetime import datetime
+from typing import Optional
+
+from fastapi import HTTPException
+
+
+def encode_cursor(doc: dict) -> str:
+    """Opaque cursor pointing just past ``doc`` in newest-first order"""
+    payload = json.dumps({"c": doc["created_at"].isoformat(), "i": doc["id"]}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def cursor_filter(cursor: Optional[str]) -> dict:
+    """Query filter selecting documents after ``cursor`` in newest-first order"""
+    if not cursor:
+        return {}
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded))
+        created_at = datetime.fromisoformat(payload["c"])
+        last_id = payload["i"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {
+        "$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "id": {"$lt": last_id}}
+        ]
+    }
+
+
+# Sort order matching the (created_at, id) indexes
+NEWEST_FIRST = [("created_at", -1), ("id", -1)]
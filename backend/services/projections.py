@@ -0,0 +1,45 @@
+"""``fields=`` selection for the admin list endpoints.
+
+A comma-separated ``fields`` query parameter (or the endpoint's default) is
+checked against the response model, turned into a Mongo projection so only
+those fields leave the database, and serialized through a variant of the
+model whose fields are all optional. ``fields=*`` selects the whole model.
+Documents still carry only model fields, so ``_id`` and stored extras never
+come back.
+"""
+from functools import lru_cache
+from typing import Iterable, Optional, Sequence, Tuple, Type
+
+from fastapi import HTTPException
+from pydantic import BaseModel, create_model
+
+
+def select_fields(model: Type[BaseModel], fields: Optional[str], default: Iterable[str],
+                  required: Sequence[str] = ("id",)) -> Tuple[str, ...]:
+    """Requested (or default) field names, with ``required`` always included"""
+    if not fields:
+        selected = list(default)
+    elif fields.strip() == "*":
+        selected = list(model.model_fields)
+    else:
+        selected = [field.strip() for field in fields.split(",") if field.strip()]
+        unknown = [field for field in selected if field not in model.model_fields]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return tuple(dict.fromkeys([*required, *selected]))
+
+
+def projection(fields: Iterable[str]) -> dict:
+    return {"_id": 0, **{field: 1 for field in fields}}
+
+
+@lru_cache(maxsize=None)
+def partial_model(model: Type[BaseModel]) -> Type[BaseModel]:
+    """``model`` with every field optional; required fields default to None"""
+    definitions = {}
+    for name, field in model.model_fields.items():
+        if field.is_required():
+            definitions[name] = (Optional[field.annotation], None)
+        else:
+            definitions[name] = (Optional[field.annotation], field)
+    return create_model(f"Partial{model.__name__}", **definitions)
@@ -0,0 +1,41 @@
+"""Single-pass JSON responses for the hot admin list endpoints.
+
+Returning models from an endpoint with a ``response_model`` makes FastAPI
+validate them a second time before serializing. ``model_list_response``
+validates the raw Mongo documents once and has pydantic-core write the JSON
+bytes directly; FastAPI passes a returned ``Response`` through untouched,
+while the ``response_model`` on the route still documents the schema.
+Everything else is rendered with orjson (the app's default response class).
+
+Given ``fields``, documents are validated against the model's all-optional
+variant and only those fields are written (see ``services.projections``).
+"""
+from functools import lru_cache
+from typing import Iterable, List, Mapping, Optional, Sequence, Type
+
+from fastapi import Response
+from pydantic import BaseModel, TypeAdapter
+
+from services.projections import partial_model
+
+
+@lru_cache(maxsize=None)
+def list_adapter(model: Type[BaseModel]) -> TypeAdapter:
+    return TypeAdapter(List[model])
+
+
+def model_list_response(model: Type[BaseModel], items: Iterable,
+                        headers: Optional[Mapping[str, str]] = None,
+                        fields: Optional[Sequence[str]] = None) -> Response:
+    """JSON array of ``model`` built from raw documents or existing instances"""
+    if fields is None:
+        adapter = list_adapter(model)
+        content = adapter.dump_json(adapter.validate_python(items))
+    else:
+        adapter = list_adapter(partial_model(model))
+        content = adapter.dump_json(adapter.validate_python(items), include={"__all__": set(fields)})
+    return Response(
+        content=content,
+        media_type="application/json",
+        headers=headers
+    )
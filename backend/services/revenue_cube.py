@@ -0,0 +1,173 @@
+"""Materialized ``daily_revenue`` cube keyed by day and delivery status.
+
+Each document holds the order count, revenue, delivery cost and final amount
+of one (day, delivery_status) cell, excluding cancelled orders. Cells are
+recomputed from ``orders`` and upserted by key; a refreshed day's cells that
+are missing from the result are deleted by key. Every worker refreshes, so a
+refresh only ever deletes cells its own result shows to be empty, never cells
+that another refresh happened to write after it started. Refreshes run when:
+
+* ``update_order`` refreshes the day of the order it changed;
+* ``RevenueCubeRefresher`` periodically refreshes every day that has orders
+  updated since its last run, which also picks up orders inserted elsewhere.
+  Its first run builds the whole cube when it is empty, and otherwise also
+  covers the days of orders saved without ``updated_at``;
+* ``python -m services.revenue_cube`` (from ``backend/``) rebuilds every day.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from pymongo import DeleteMany, ReplaceOne
+
+from services.aggregations import ORDER_DAY, ORDER_FINAL_AMOUNT
+
+logger = logging.getLogger(__name__)
+
+DAY_FORMAT = "%Y-%m-%d"
+WATERMARK_OVERLAP = timedelta(minutes=1)
+
+
+def order_day(created_at: datetime) -> str:
+    return created_at.strftime(DAY_FORMAT)
+
+
+def _refresh_pipeline(days: Optional[List[str]], refreshed_at: datetime) -> list:
+    match = {"status": {"$ne": "cancelled"}}
+    if days:
+        # One created_at range per day so sparse days stay index-bounded
+        match["$or"] = [
+            {"created_at": {"$gte": start, "$lt": start + timedelta(days=1)}}
+            for start in (datetime.strptime(day, DAY_FORMAT) for day in days)
+        ]
+
+    return [
+        {"$match": match},
+        {
+            "$group": {
+                "_id": {"date": ORDER_DAY, "delivery_status": "$delivery_status"},
+                "total_orders": {"$sum": 1},
+                "total_revenue": {"$sum": {"$ifNull": ["$total_amount", 0]}},
+                "total_delivery_cost": {"$sum": {"$ifNull": ["$delivery_cost", 0]}},
+                "final_amount": {"$sum": ORDER_FINAL_AMOUNT}
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "date": "$_id.date",
+                "delivery_status": "$_id.delivery_status",
+                "total_orders": 1,
+                "total_revenue": 1,
+                "total_delivery_cost": 1,
+                "final_amount": 1,
+                "refreshed_at": {"$literal": refreshed_at}
+            }
+        }
+    ]
+
+
+async def refresh_daily_revenue(db, days: Optional[Iterable[str]] = None):
+    """Recompute the cube cells for ``days`` (every day when omitted)"""
+    days = sorted(set(days)) if days is not None else None
+    if days == []:
+        return
+    refreshed_at = datetime.utcnow()
+    # At most a few cells per day, so the result is small enough to hold
+    cells = await db.orders.aggregate(_refresh_pipeline(days, refreshed_at), allowDiskUse=True).to_list(None)
+
+    statuses_by_day: Dict[str, list] = {}
+    writes = []
+    for cell in cells:
+        statuses_by_day.setdefault(cell["date"], []).append(cell["delivery_status"])
+        writes.append(ReplaceOne(
+            {"date": cell["date"], "delivery_status": cell["delivery_status"]}, cell, upsert=True
+        ))
+
+    # Cells absent from the result lost all their orders (cancelled, or
+    # moved to another delivery status) and must go
+    for day, statuses in statuses_by_day.items():
+        writes.append(DeleteMany({"date": day, "delivery_status": {"$nin": statuses}}))
+    emptied = {"$in": [day for day in days if day not in statuses_by_day]} if days else {"$nin": list(statuses_by_day)}
+    writes.append(DeleteMany({"date": emptied}))
+
+    await db.daily_revenue.bulk_write(writes, ordered=False)
+
+
+async def days_updated_since(db, since: datetime, include_unstamped: bool = False) -> List[str]:
+    """Days holding at least one order created or updated since ``since``"""
+    match = {"updated_at": {"$gte": since}}
+    if include_unstamped:
+        match = {"$or": [match, {"updated_at": None}]}
+    pipeline = [
+        {"$match": match},
+        {"$group": {"_id": ORDER_DAY}}
+    ]
+    return [doc["_id"] async for doc in db.orders.aggregate(pipeline) if doc["_id"]]
+
+
+class RevenueCubeRefresher:
+    """Background job keeping the cube in step with recently updated orders"""
+
+    def __init__(self, db, interval: float = 300.0, lookback: timedelta = timedelta(days=2)):
+        self.db = db
+        self.interval = interval
+        # The first run covers orders updated in this window before startup
+        self._watermark = datetime.utcnow() - lookback
+        self._first_run = True
+        self._task = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def refresh(self):
+        # Orders stamped just before the previous run may not have been
+        # visible to it, so overlap each window slightly
+        started = datetime.utcnow()
+        if self._first_run and await self.db.daily_revenue.find_one({}, {"_id": 1}) is None:
+            # Fresh deployment: reports read only the cube, so fill all of it
+            await refresh_daily_revenue(self.db)
+            logger.info("Built the daily revenue cube from every order")
+            self._first_run = False
+            self._watermark = started
+            return []
+
+        # Orders without updated_at never pass the watermark; catch them once
+        days = await days_updated_since(self.db, self._watermark - WATERMARK_OVERLAP,
+                                        include_unstamped=self._first_run)
+        await refresh_daily_revenue(self.db, days)
+        self._first_run = False
+        self._watermark = started
+        return days
+
+    async def _run(self):
+        while True:
+            try:
+                days = await self.refresh()
+                if days:
+                    logger.info("Refreshed daily revenue for %d days", len(days))
+            except Exception:
+                logger.exception("Daily revenue refresh failed")
+            await asyncio.sleep(self.interval)
+
+
+async def rebuild_daily_revenue(db) -> dict:
+    await db.daily_revenue.create_index([("date", 1), ("delivery_status", 1)], unique=True)
+    await refresh_daily_revenue(db)
+    return {"cells": await db.daily_revenue.count_documents({})}
+
+
+if __name__ == "__main__":
+    from services.cli import run_command
+    run_command(rebuild_daily_revenue)
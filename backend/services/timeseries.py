@@ -0,0 +1,147 @@
+"""Opt-in time-series layout for the raw event collections.
+
+With ``EVENTS_TIMESERIES=true`` the app creates ``visitor_events`` and
+``link_tracking`` as MongoDB time-series collections (MongoDB 5.0+), with
+``timestamp`` as the time field and the session or link id as the meta
+field. Documents keep their shape, so inserts and analytics queries are the
+same for either layout. ``EVENTS_TIMESERIES_GRANULARITY`` is one of
+``seconds`` (default), ``minutes`` or ``hours``.
+
+Collections that already exist as regular collections are left alone at
+startup. Run ``python -m services.timeseries`` from ``backend/`` with the
+app stopped to move them across: each one is renamed to
+``<name>_legacy``, recreated as a time-series collection and refilled in
+``_id`` order with ordered batches, so the copy is always a prefix of the
+legacy collection. Rerunning the command after a failure resumes the copy
+after the last ``_id`` copied, and every run compares document counts. The
+legacy copy is kept until you drop it.
+"""
+import logging
+import os
+from typing import Dict, Optional
+
+from services.indexes import apply_indexes
+
+logger = logging.getLogger(__name__)
+
+# Raw event collection -> meta field
+TIMESERIES_COLLECTIONS = {
+    "visitor_events": "session_id",
+    "link_tracking": "link_id",
+}
+TIME_FIELD = "timestamp"
+GRANULARITIES = ("seconds", "minutes", "hours")
+COPY_BATCH_SIZE = 1000
+
+
+def timeseries_enabled() -> bool:
+    return os.environ.get('EVENTS_TIMESERIES', '').lower() in ('1', 'true', 'yes')
+
+
+def timeseries_granularity() -> str:
+    granularity = os.environ.get('EVENTS_TIMESERIES_GRANULARITY', 'seconds')
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"EVENTS_TIMESERIES_GRANULARITY must be one of {', '.join(GRANULARITIES)}")
+    return granularity
+
+
+def timeseries_options(collection: str, granularity: str) -> dict:
+    return {
+        "timeField": TIME_FIELD,
+        "metaField": TIMESERIES_COLLECTIONS[collection],
+        "granularity": granularity,
+    }
+
+
+async def collection_types(db) -> Dict[str, str]:
+    """``collection`` or ``timeseries`` for each existing raw event collection"""
+    cursor = await db.list_collections(filter={"name": {"$in": list(TIMESERIES_COLLECTIONS)}})
+    return {info["name"]: info.get("type", "collection") async for info in cursor}
+
+
+async def ensure_timeseries_collections(db, granularity: str):
+    """Create missing raw event collections as time-series collections.
+
+    Must run before ``apply_indexes``, which would otherwise create them as
+    regular collections.
+    """
+    existing = await collection_types(db)
+    for collection in TIMESERIES_COLLECTIONS:
+        kind = existing.get(collection)
+        if kind is None:
+            await db.create_collection(collection, timeseries=timeseries_options(collection, granularity))
+            logger.info("Created time-series collection %s", collection)
+        elif kind != "timeseries":
+            logger.warning("%s is a regular collection; run python -m services.timeseries to migrate it",
+                           collection)
+
+
+async def _copy_from_legacy(db, collection: str, legacy: str) -> int:
+    """Copy legacy documents past the last ``_id`` already in ``collection``"""
+    last = await db[collection].find({}, {"_id": 1}).sort("_id", -1).limit(1).to_list(1)
+    # Time-series documents need a date in the time field
+    query = {TIME_FIELD: {"$type": "date"}}
+    if last:
+        query["_id"] = {"$gt": last[0]["_id"]}
+
+    copied = 0
+    batch = []
+    cursor = db[legacy].find(query, batch_size=COPY_BATCH_SIZE).sort("_id", 1)
+    async for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= COPY_BATCH_SIZE:
+            await db[collection].insert_many(batch, ordered=True)
+            copied += len(batch)
+            batch = []
+    if batch:
+        await db[collection].insert_many(batch, ordered=True)
+        copied += len(batch)
+    return copied
+
+
+async def migrate_to_timeseries(db) -> Dict[str, dict]:
+    """Move every regular raw event collection into a time-series collection.
+
+    Safe to rerun: an existing ``<name>_legacy`` collection means an earlier
+    run got past the rename, so its copy is resumed and verified.
+    """
+    granularity = timeseries_granularity()
+    existing = await collection_types(db)
+    legacy_names = set(await db.list_collection_names())
+    results = {}
+    for collection in TIMESERIES_COLLECTIONS:
+        legacy = f"{collection}_legacy"
+        kind: Optional[str] = existing.get(collection)
+        if legacy not in legacy_names:
+            if kind == "timeseries":
+                continue
+            if kind is not None:
+                await db[collection].rename(legacy)
+                kind = None
+        elif kind == "collection":
+            raise RuntimeError(
+                f"{collection} and {legacy} are both regular collections; merge or drop one of them "
+                "before rerunning the migration"
+            )
+        if kind is None:
+            await db.create_collection(collection, timeseries=timeseries_options(collection, granularity))
+
+        copied = await _copy_from_legacy(db, collection, legacy)
+        expected = await db[legacy].count_documents({TIME_FIELD: {"$type": "date"}})
+        stored = await db[collection].count_documents({})
+        results[collection] = {"copied": copied, "expected": expected, "stored": stored, "complete": stored == expected}
+        if stored == expected:
+            logger.info("Copied %d documents from %s into time-series %s (%d in total)",
+                        copied, legacy, collection, stored)
+        else:
+            logger.error("%s holds %d documents but %s has %d to copy; inspect both before dropping %s",
+                         collection, stored, legacy, expected, legacy)
+
+    # Recreate the registry indexes on the new collections
+    await apply_indexes(db)
+    return results
+
+
+if __name__ == "__main__":
+    from services.cli import run_command
+    run_command(migrate_to_timeseries)
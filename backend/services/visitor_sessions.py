@@ -0,0 +1,96 @@
+"""Idempotent visitor session heartbeats.
+
+A heartbeat is a single upsert keyed on the unique ``session_id`` index:
+``$setOnInsert`` records the first visit and how the visitor arrived, ``$set``
+moves ``last_activity``. Concurrent first hits for one session therefore end
+up as one document (the server retries the losing upsert as an update).
+
+That guarantee needs the unique index, which cannot be built while duplicate
+sessions from the old read-then-insert race remain. ``python -m
+services.visitor_sessions`` from ``backend/`` merges them; the index is then
+created on the next startup.
+"""
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from pymongo import DeleteMany, UpdateOne
+
+from services.event_buffer import SESSION_COUNTERS
+
+MERGE_CHUNK_SIZE = 1000
+
+# Fields only recorded when the session document is created
+INSERT_ONLY_FIELDS = ("visitor_type", "referral_link_token", "ip_address", "user_agent")
+
+
+def session_update(seen_at: datetime, **details) -> dict:
+    on_insert = {field: details.get(field) for field in INSERT_ONLY_FIELDS}
+    on_insert["first_visit"] = seen_at
+    return {"$setOnInsert": on_insert, "$set": {"last_activity": seen_at}}
+
+
+async def record_heartbeat(db, session_id: str, seen_at: Optional[datetime] = None, **details):
+    await db.visitor_sessions.update_one(
+        {"session_id": session_id},
+        session_update(seen_at or datetime.utcnow(), **details),
+        upsert=True
+    )
+
+
+async def record_heartbeats(db, heartbeats: Iterable[dict], seen_at: Optional[datetime] = None) -> int:
+    """Upsert a batch of heartbeats in one bulk write; returns the sessions touched"""
+    seen_at = seen_at or datetime.utcnow()
+    # The first heartbeat of a session in the batch supplies its insert-only details
+    sessions: Dict[str, dict] = {}
+    for heartbeat in heartbeats:
+        sessions.setdefault(heartbeat["session_id"], heartbeat)
+
+    upserts: List[UpdateOne] = [
+        UpdateOne({"session_id": session_id}, session_update(seen_at, **heartbeat), upsert=True)
+        for session_id, heartbeat in sessions.items()
+    ]
+    if upserts:
+        await db.visitor_sessions.bulk_write(upserts, ordered=False)
+    return len(upserts)
+
+
+async def merge_duplicate_sessions(db) -> dict:
+    """Fold every group of documents sharing a ``session_id`` into its earliest one"""
+    summed = sorted(set(SESSION_COUNTERS.values())) + ["total_order_value"]
+    pipeline = [
+        {"$sort": {"first_visit": 1}},
+        {
+            "$group": {
+                "_id": "$session_id",
+                "ids": {"$push": "$_id"},
+                "last_activity": {"$max": "$last_activity"},
+                "converted_to_customer": {"$max": "$converted_to_customer"},
+                **{field: {"$sum": f"${field}"} for field in summed}
+            }
+        },
+        {"$match": {"ids.1": {"$exists": True}}},
+    ]
+
+    counts = {"sessions": 0, "removed": 0}
+    writes = []
+    async for group in db.visitor_sessions.aggregate(pipeline, allowDiskUse=True):
+        # The earliest document keeps its first visit and arrival details
+        keep, *duplicates = group["ids"]
+        merged = {field: group[field] for field in summed}
+        merged["last_activity"] = group["last_activity"]
+        if group["converted_to_customer"]:
+            merged["converted_to_customer"] = True
+        writes += [UpdateOne({"_id": keep}, {"$set": merged}), DeleteMany({"_id": {"$in": duplicates}})]
+        counts["sessions"] += 1
+        counts["removed"] += len(duplicates)
+        if len(writes) >= MERGE_CHUNK_SIZE:
+            await db.visitor_sessions.bulk_write(writes)
+            writes = []
+    if writes:
+        await db.visitor_sessions.bulk_write(writes)
+    return counts
+
+
+if __name__ == "__main__":
+    from services.cli import run_command
+    run_command(merge_duplicate_sessions)